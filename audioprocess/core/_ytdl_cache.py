@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+yt-dlp 视频信息缓存
+-----------------
+按视频ID把extract_info解析出的视频信息缓存到磁盘，重复下载同一视频时跳过页面和播放器解析
+"""
+
+import os
+import json
+import time
+import threading
+
+from audioprocess.utils.logger import get_logger
+from audioprocess.utils.http_utils import loads_json
+from audioprocess.config.settings import DOWNLOADS_DIR
+
+logger = get_logger(__name__)
+
+# 缓存目录，每个视频一个JSON文件
+CACHE_DIR = os.path.join(DOWNLOADS_DIR, '.ytdl_info')
+# 默认缓存有效期（秒），YouTube的媒体地址通常在数小时后失效
+DEFAULT_EXPIRE = 3600
+
+_lock = threading.Lock()
+
+def _cache_path(video_id):
+    return os.path.join(CACHE_DIR, f"{video_id}.json")
+
+def load(video_id):
+    """
+    读取缓存的视频信息
+    
+    参数:
+        video_id: YouTube视频ID
+        
+    返回:
+        视频信息字典，未命中或已过期时返回None
+    """
+    path = _cache_path(video_id)
+    try:
+        with open(path, 'rb') as f:
+            entry = loads_json(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取视频信息缓存失败: {str(e)}")
+        return None
+    
+    if entry.get('expires', 0) < time.time():
+        invalidate(video_id)
+        return None
+    return entry.get('info')
+
+def store(video_id, info, expire=DEFAULT_EXPIRE):
+    """
+    写入视频信息缓存
+    
+    参数:
+        video_id: YouTube视频ID
+        info: 经过sanitize_info处理、可JSON序列化的视频信息
+        expire: 有效期（秒）
+    """
+    path = _cache_path(video_id)
+    entry = {'expires': time.time() + expire, 'info': info}
+    try:
+        with _lock:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f"写入视频信息缓存失败: {str(e)}")
+
+def invalidate(video_id):
+    """
+    删除缓存的视频信息
+    
+    参数:
+        video_id: YouTube视频ID
+    """
+    try:
+        os.unlink(_cache_path(video_id))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"删除视频信息缓存失败: {str(e)}")
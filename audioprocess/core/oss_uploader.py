@@ -6,9 +6,9 @@
 """
 
 import os
-import random
-import string
-from datetime import datetime
+import functools
+import secrets
+import time
 import oss2
 from oss2.credentials import EnvironmentVariableCredentialsProvider
 
@@ -18,15 +18,22 @@ from audioprocess.config.settings import (
     OSS_REGION, 
     OSS_BUCKET_NAME, 
     OSS_ACCESS_KEY_ID, 
-    OSS_ACCESS_KEY_SECRET
+    OSS_ACCESS_KEY_SECRET,
+    TEMP_DIR
 )
 
 logger = get_logger(__name__)
 
+# 对象名中时间戳的格式
+_TS_FMT = "%Y%m%d%H%M%S"
+# 简单上传时读取本地文件的缓冲区大小
+_READ_BUFFER_SIZE = 4 * 1024 * 1024
+
 class OssUploader:
     """阿里云OSS上传器类"""
     
-    def __init__(self, bucket_name=None, endpoint=None, region=None, access_key_id=None, access_key_secret=None):
+    def __init__(self, bucket_name=None, endpoint=None, region=None, access_key_id=None, access_key_secret=None,
+                 part_size=4 * 1024 * 1024, num_threads=4, multipart_threshold=8 * 1024 * 1024):
         """
         初始化上传器
         
@@ -36,12 +43,18 @@ class OssUploader:
             region: OSS区域，默认使用配置中的区域
             access_key_id: 访问密钥ID，默认使用配置中的密钥ID
             access_key_secret: 访问密钥密码，默认使用配置中的密钥密码
+            part_size: 分片上传时每个分片的大小（字节），默认4MB
+            num_threads: 分片上传的并发线程数，默认4
+            multipart_threshold: 超过该大小（字节）的文件使用分片上传，默认8MB
         """
         self.bucket_name = bucket_name or OSS_BUCKET_NAME
         self.endpoint = endpoint or OSS_ENDPOINT
         self.region = region or OSS_REGION
         self.access_key_id = access_key_id or OSS_ACCESS_KEY_ID
         self.access_key_secret = access_key_secret or OSS_ACCESS_KEY_SECRET
+        self.part_size = part_size
+        self.num_threads = num_threads
+        self.multipart_threshold = multipart_threshold
         
         # 初始化OSS客户端
         self.bucket = self._init_bucket()
@@ -56,7 +69,9 @@ class OssUploader:
         返回:
             上传文件的签名URL或None（如果上传失败）
         """
-        if not os.path.exists(file_path):
+        try:
+            file_size = os.stat(file_path).st_size
+        except FileNotFoundError:
             logger.error(f"文件不存在: {file_path}")
             return None
         
@@ -64,10 +79,22 @@ class OssUploader:
             # 生成唯一的对象名
             object_name = self._generate_object_name(file_path)
             
-            # 上传文件
             logger.info(f"开始上传文件到OSS: {object_name}")
-            with open(file_path, 'rb') as file_obj:
-                result = self.bucket.put_object(object_name, file_obj)
+            if file_size < self.multipart_threshold:
+                # 小文件直接上传，使用大缓冲区减少读取次数
+                with open(file_path, 'rb', buffering=_READ_BUFFER_SIZE) as file_obj:
+                    result = self.bucket.put_object(object_name, file_obj)
+            else:
+                # 大文件分片并发上传，失败后可断点续传
+                result = oss2.resumable_upload(
+                    self.bucket,
+                    object_name,
+                    file_path,
+                    store=oss2.ResumableStore(root=TEMP_DIR),
+                    multipart_threshold=self.multipart_threshold,
+                    part_size=self.part_size,
+                    num_threads=self.num_threads
+                )
             
             if result.status == 200:
                 logger.info(f"文件上传成功，状态码: {result.status}")
@@ -125,20 +152,26 @@ class OssUploader:
             生成的对象名
         """
         # 使用时间戳和随机数生成纯英文文件名
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        timestamp = time.strftime(_TS_FMT, time.gmtime())
         
-        # 生成随机字符串作为前缀
-        random_prefix = ''.join(random.choices(string.ascii_lowercase, k=8))
+        # 生成8位十六进制随机前缀
+        random_prefix = secrets.token_hex(4)
         
-        # 保留原始扩展名
-        _, ext = os.path.splitext(file_path)
+        # 保留原始扩展名（只在文件名部分查找，忽略以点开头的隐藏文件名）
+        name_start = file_path.rfind(os.sep) + 1
+        dot = file_path.rfind('.', name_start)
         # 确保扩展名是小写英文字母
-        ext = ext.lower()
+        ext = file_path[dot:].lower() if dot > name_start else ''
         
         # 构建纯英文文件名
         return f"audio_{random_prefix}_{timestamp}{ext}"
 
 # 方便直接使用的函数
+@functools.lru_cache(maxsize=1)
+def _default_uploader():
+    """获取便捷函数共享的上传器，复用Bucket及其连接池"""
+    return OssUploader()
+
 def upload_file_to_oss(file_path):
     """
     上传文件到阿里云OSS的便捷函数
@@ -149,5 +182,4 @@ def upload_file_to_oss(file_path):
     返回:
         上传文件的签名URL或None（如果上传失败）
     """
-    uploader = OssUploader()
-    return uploader.upload(file_path) 
\ No newline at end of file
+    return _default_uploader().upload(file_path) 
\ No newline at end of file
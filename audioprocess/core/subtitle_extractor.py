@@ -6,17 +6,27 @@ YouTube 字幕提取模块
 """
 
 import os
-import json
+import functools
+import re
+from itertools import chain
 import requests
 from datetime import datetime
 import yt_dlp
 
 from audioprocess.utils.logger import get_logger
 from audioprocess.utils.proxy_manager import get_http_proxy
+from audioprocess.utils.http_utils import get_http_session, loads_json
+from audioprocess.utils.file_utils import ensure_dir_once
 from audioprocess.config.settings import TEMP_DIR, RESULTS_DIR, SUPPORTED_LANGUAGES
 
 logger = get_logger(__name__)
 
+# 文本字幕中需要丢弃的行：时间轴、WebVTT头部、纯序号行和空行
+_VTT_NOISE = re.compile(rb'-->|WEBVTT|^\s*\d*\s*$')
+
+# 字幕格式优先级，优先选择文本格式
+_PREFERRED_FORMATS = ('vtt', 'ttml', 'srv3', 'srv2', 'srv1', 'json3')
+
 class SubtitleExtractor:
     """YouTube字幕提取器类"""
     
@@ -30,9 +40,10 @@ class SubtitleExtractor:
         """
         self.temp_dir = temp_dir or TEMP_DIR
         self.proxy = proxy
+        self._session = get_http_session()
         
-        # 确保临时目录存在
-        os.makedirs(self.temp_dir, exist_ok=True)
+        # 确保临时目录存在（每个路径只在首次构造时创建）
+        ensure_dir_once(self.temp_dir)
     
     def extract(self, url):
         """
@@ -57,52 +68,69 @@ class SubtitleExtractor:
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 # 提取视频信息，包括字幕
                 info = ydl.extract_info(url, download=False)
-                
-                if not info:
-                    logger.error("无法获取视频信息")
-                    return None
-                
-                # 检查是否有字幕可用
-                if not info.get('subtitles') and not info.get('automatic_captions'):
-                    logger.info("该视频没有可用的字幕（手动或自动）")
-                    return None
-                
-                # 获取字幕信息
-                subtitles_info = self._find_best_subtitle(info)
-                if not subtitles_info:
-                    return None
-                
-                # 下载和解析字幕
-                subtitle_content = self._download_subtitle(subtitles_info['url'])
-                if not subtitle_content:
-                    return None
-                
-                # 解析字幕内容
-                subtitle_text = self._parse_subtitle(subtitle_content, subtitles_info['format'])
-                if not subtitle_text:
-                    return None
-                
-                # 保存字幕文本到文件
-                subtitle_file = self._save_subtitle(
-                    subtitle_text, 
-                    url, 
-                    subtitles_info['language'], 
-                    subtitles_info['format']
-                )
-                
-                # 返回字幕信息
-                return {
-                    'text': subtitle_text,
-                    'language': subtitles_info['language'],
-                    'format': subtitles_info['format'],
-                    'subtitle_file': subtitle_file,
-                    'video_url': url
-                }
+            
+            return self._extract_from_info(info, url)
                 
         except Exception as e:
             logger.error(f"提取字幕时出错: {str(e)}")
             return None
     
+    def _extract_from_info(self, info, url):
+        """
+        根据视频信息选择、下载并保存字幕
+        
+        参数:
+            info: yt-dlp返回的视频信息字典
+            url: 视频URL
+            
+        返回:
+            字典，包含字幕文本和语言信息，如果没有字幕则返回None
+        """
+        if not info:
+            logger.error("无法获取视频信息")
+            return None
+        
+        # 检查是否有字幕可用
+        if not info.get('subtitles') and not info.get('automatic_captions'):
+            logger.info("该视频没有可用的字幕（手动或自动）")
+            return None
+        
+        # 获取字幕信息
+        subtitles_info = self._find_best_subtitle(info)
+        if not subtitles_info:
+            return None
+        
+        # 下载和解析字幕（流式下载，边下载边解析）
+        response = self._download_subtitle(subtitles_info['url'])
+        if response is None:
+            return None
+        
+        # 解析字幕内容
+        try:
+            subtitle_text = self._parse_subtitle(response, subtitles_info['format'])
+        finally:
+            response.close()
+        if not subtitle_text:
+            return None
+        
+        # 保存字幕文本到文件
+        subtitle_file = self._save_subtitle(
+            subtitle_text, 
+            url, 
+            subtitles_info['language'], 
+            subtitles_info['format']
+        )
+        
+        # 返回字幕信息
+        return {
+            'text': subtitle_text,
+            'preview': subtitle_text[:300],
+            'language': subtitles_info['language'],
+            'format': subtitles_info['format'],
+            'subtitle_file': subtitle_file,
+            'video_url': url
+        }
+    
     def _get_ydl_opts(self):
         """获取yt-dlp选项配置"""
         ydl_opts = {
@@ -161,18 +189,14 @@ class SubtitleExtractor:
         logger.info(f"找到字幕，语言: {selected_lang}")
         subtitle_formats = subtitles_dict[selected_lang]
         
-        # 优先选择文本格式的字幕
-        preferred_formats = ['vtt', 'ttml', 'srv3', 'srv2', 'srv1', 'json3']
+        # 按扩展名索引字幕链接（同一扩展名保留首个），再按优先级查找
+        by_ext = {s.get('ext'): s['url'] for s in reversed(subtitle_formats) if s.get('url')}
         selected_format = None
         subtitle_url = None
         
-        for fmt in preferred_formats:
-            for subtitle in subtitle_formats:
-                if subtitle.get('ext') == fmt:
-                    selected_format = fmt
-                    subtitle_url = subtitle.get('url')
-                    break
-            if selected_format:
+        for fmt in _PREFERRED_FORMATS:
+            if fmt in by_ext:
+                selected_format, subtitle_url = fmt, by_ext[fmt]
                 break
         
         if not subtitle_url:
@@ -192,60 +216,54 @@ class SubtitleExtractor:
     
     def _download_subtitle(self, url):
         """
-        下载字幕内容
+        以流式方式下载字幕
         
         参数:
             url: 字幕URL
             
         返回:
-            字幕内容文本或None（如果下载失败）
+            尚未读取响应体的响应对象或None（如果下载失败），调用方负责关闭
         """
         try:
             logger.info(f"开始下载字幕: {url}")
-            response = requests.get(url, timeout=30)
+            response = self._session.get(url, timeout=30, stream=True)
             response.raise_for_status()
-            return response.text
+            return response
         except requests.exceptions.RequestException as e:
             logger.error(f"下载字幕失败: {str(e)}")
             return None
     
-    def _parse_subtitle(self, content, format_type):
+    def _parse_subtitle(self, response, format_type):
         """
         解析字幕内容
         
         参数:
-            content: 字幕内容文本
+            response: 字幕下载的流式响应对象
             format_type: 字幕格式
             
         返回:
             解析后的纯文本字幕或None（如果解析失败）
         """
-        if not content:
+        if response is None:
             return None
         
         try:
             # 根据字幕格式选择不同的解析方法
             if format_type == 'json3':
-                return self._parse_json_subtitle(content)
+                return self._parse_json_subtitle(response)
             else:
-                return self._parse_text_subtitle(content)
+                return self._parse_text_subtitle(response)
         except Exception as e:
             logger.error(f"解析字幕失败: {str(e)}")
             return None
     
-    def _parse_json_subtitle(self, content):
+    def _parse_json_subtitle(self, response):
         """解析JSON格式的字幕"""
-        json_data = json.loads(content)
+        # JSON需要完整文档才能解析，直接解析原始字节，省去一次str解码
+        json_data = loads_json(response.content)
         events = json_data.get('events', [])
-        subtitle_text = ""
-        
-        for event in events:
-            if 'segs' in event:
-                for seg in event['segs']:
-                    if 'utf8' in seg:
-                        subtitle_text += seg['utf8'] + " "
-        
-        subtitle_text = subtitle_text.strip()
+        segs = chain.from_iterable(event.get('segs', ()) for event in events)
+        subtitle_text = " ".join(filter(None, (seg.get('utf8') for seg in segs))).strip()
         
         if not subtitle_text:
             logger.error("提取的字幕内容为空")
@@ -253,22 +271,19 @@ class SubtitleExtractor:
             
         return subtitle_text
     
-    def _parse_text_subtitle(self, content):
-        """解析文本格式的字幕（VTT、SRT等）"""
-        lines = content.split('\n')
-        subtitle_text = ""
+    def _parse_text_subtitle(self, response):
+        """解析文本格式的字幕（VTT、SRT等），逐行读取响应流"""
+        parts = []
         
-        for line in lines:
-            # 跳过时间戳和元数据行
-            if '-->' in line or line.strip().isdigit() or not line.strip():
-                continue
-            # 跳过WebVTT头部
-            if 'WEBVTT' in line:
+        # 按字节过滤各行，只在最后对保留的文本解码一次
+        for line in response.iter_lines(chunk_size=64 * 1024):
+            # 跳过时间戳、序号、空行和WebVTT头部
+            if _VTT_NOISE.search(line):
                 continue
             # 保留文本内容
-            subtitle_text += line.strip() + " "
+            parts.append(line.strip())
         
-        subtitle_text = subtitle_text.strip()
+        subtitle_text = b" ".join(parts).decode(response.encoding or 'utf-8', errors='replace').strip()
         
         if not subtitle_text:
             logger.error("提取的字幕内容为空")
@@ -296,9 +311,9 @@ class SubtitleExtractor:
             filepath = os.path.join(RESULTS_DIR, filename)
             
             # 写入文件
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(f"YouTube视频: {video_url}\n字幕语言: {language}\n字幕格式: {format_type}\n\n")
-                f.write(text)
+            header = f"YouTube视频: {video_url}\n字幕语言: {language}\n字幕格式: {format_type}\n\n"
+            with open(filepath, 'wb') as f:
+                f.write("".join((header, text)).encode('utf-8'))
             
             logger.info(f"字幕内容已保存至: {filepath}")
             return filepath
@@ -307,6 +322,11 @@ class SubtitleExtractor:
             return None
 
 # 方便直接使用的函数
+@functools.lru_cache(maxsize=8)
+def _default_extractor(proxy):
+    """获取便捷函数共享的字幕提取器，按代理设置区分"""
+    return SubtitleExtractor(proxy=proxy)
+
 def extract_youtube_subtitles(url, proxy=None):
     """
     从YouTube视频中提取字幕的便捷函数
@@ -318,5 +338,4 @@ def extract_youtube_subtitles(url, proxy=None):
     返回:
         字典，包含提取到的字幕文本和语言信息，如果没有字幕则返回None
     """
-    extractor = SubtitleExtractor(proxy=proxy)
-    return extractor.extract(url) 
\ No newline at end of file
+    return _default_extractor(proxy).extract(url) 
\ No newline at end of file
@@ -6,11 +6,15 @@
 """
 
 import os
+import functools
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import httpx
 from openai import OpenAI
 
 from audioprocess.utils.logger import get_logger
-from audioprocess.utils.proxy_manager import no_proxy_context
 from audioprocess.config.settings import (
     DASHSCOPE_API_KEY,
     OPENAI_BASE_URL,
@@ -21,6 +25,14 @@ from audioprocess.config.settings import (
 
 logger = get_logger(__name__)
 
+# 单次请求允许的最大原文字符数，超出后按分块摘要再汇总
+_CHUNK_CHARS = int(os.environ.get("SUMMARY_CHUNK_CHARS", "6000"))
+# 分块摘要的最大并发数
+_MAP_WORKERS = 8
+# 段落内的句子边界，用于切分过长的段落
+_SENTENCE_END = re.compile(r'(?<=[。！？!?.])\s*')
+_FAILED_PREFIX = "摘要生成失败"
+
 class TextSummarizer:
     """文本摘要器类"""
     
@@ -36,6 +48,37 @@ class TextSummarizer:
         self.api_key = api_key or os.environ.get("DASHSCOPE_API_KEY", DASHSCOPE_API_KEY)
         self.base_url = base_url or OPENAI_BASE_URL
         self.model = model or OPENAI_MODEL
+        # 按是否禁用代理缓存的 OpenAI 客户端，复用底层连接池
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+    
+    def _get_client(self, disable_proxy):
+        """
+        获取（必要时创建）OpenAI 客户端
+        
+        参数:
+            disable_proxy: 是否禁用代理。为 True 时底层 httpx 客户端忽略代理环境变量
+            
+        返回:
+            OpenAI 客户端对象
+        """
+        client = self._clients.get(disable_proxy)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(disable_proxy)
+                if client is None:
+                    http_client = httpx.Client(
+                        trust_env=not disable_proxy,
+                        limits=httpx.Limits(max_keepalive_connections=8, max_connections=16),
+                        timeout=60
+                    )
+                    client = OpenAI(
+                        api_key=self.api_key,
+                        base_url=self.base_url,
+                        http_client=http_client
+                    )
+                    self._clients[disable_proxy] = client
+        return client
     
     def summarize(self, text, disable_proxy=True):
         """
@@ -55,43 +98,103 @@ class TextSummarizer:
         try:
             logger.info("开始使用 Qwen 大模型进行文本摘要...")
             
-            # 构建提示词，要求模型进行文本摘要
-            system_prompt = SUMMARY_SYSTEM_PROMPT
-            user_prompt = f"请总结以下文本内容：\n\n{text}"
+            chunks = self._chunk(text)
+            if len(chunks) == 1:
+                # 构建提示词，要求模型进行文本摘要
+                user_prompt = f"请总结以下文本内容：\n\n{text}"
+                return self._call_api(SUMMARY_SYSTEM_PROMPT, user_prompt, disable_proxy)
             
-            # 确定是否需要禁用代理
-            if disable_proxy:
-                # 使用代理上下文管理器禁用代理
-                with no_proxy_context():
-                    return self._call_api(system_prompt, user_prompt)
-            else:
-                # 不改变代理设置
-                return self._call_api(system_prompt, user_prompt)
+            return self._map_reduce(chunks, disable_proxy)
             
         except Exception as e:
             logger.error(f"生成文本摘要时出错: {str(e)}")
             return f"摘要生成失败: {str(e)}"
     
-    def _call_api(self, system_prompt, user_prompt):
+    def _chunk(self, text, max_chars=None):
+        """
+        在段落边界处把长文本切分为若干块
+        
+        单个段落超长时再按句子边界切分，仍超长的句子直接按长度截断
+        
+        参数:
+            text: 原文本
+            max_chars: 每块的最大字符数，默认使用 SUMMARY_CHUNK_CHARS
+            
+        返回:
+            文本块列表
+        """
+        max_chars = max_chars or _CHUNK_CHARS
+        if len(text) <= max_chars:
+            return [text]
+        
+        pieces = []
+        for paragraph in text.split("\n\n"):
+            if len(paragraph) <= max_chars:
+                pieces.append(paragraph)
+                continue
+            for sentence in _SENTENCE_END.split(paragraph):
+                for start in range(0, len(sentence), max_chars):
+                    pieces.append(sentence[start:start + max_chars])
+        
+        chunks = []
+        current = []
+        size = 0
+        for piece in pieces:
+            if current and size + len(piece) > max_chars:
+                chunks.append("\n\n".join(current))
+                current = []
+                size = 0
+            current.append(piece)
+            size += len(piece) + 2
+        if current:
+            chunks.append("\n\n".join(current))
+        return chunks
+    
+    def _map_reduce(self, chunks, disable_proxy):
+        """
+        并发摘要每个文本块，再把各块摘要汇总为最终摘要
+        
+        参数:
+            chunks: 文本块列表
+            disable_proxy: 是否绕过代理发送请求
+            
+        返回:
+            摘要文本或错误消息
+        """
+        total = len(chunks)
+        logger.info(f"文本较长，分为 {total} 块进行摘要")
+        
+        def summarize_chunk(item):
+            index, chunk = item
+            user_prompt = f"以下是一篇长文本的第 {index}/{total} 部分，请总结这部分内容：\n\n{chunk}"
+            return self._call_api(SUMMARY_SYSTEM_PROMPT, user_prompt, disable_proxy)
+        
+        with ThreadPoolExecutor(max_workers=min(_MAP_WORKERS, total)) as executor:
+            partials = list(executor.map(summarize_chunk, enumerate(chunks, 1)))
+        
+        for partial in partials:
+            if partial.startswith(_FAILED_PREFIX):
+                return partial
+        
+        joined = "\n\n".join(f"第 {i} 部分摘要：\n{p}" for i, p in enumerate(partials, 1))
+        user_prompt = f"以下是一篇长文本各部分的摘要，请将它们整合为一份完整、连贯的摘要：\n\n{joined}"
+        return self._call_api(SUMMARY_SYSTEM_PROMPT, user_prompt, disable_proxy)
+    
+    def _call_api(self, system_prompt, user_prompt, disable_proxy=True):
         """
         调用 API 生成摘要
         
         参数:
             system_prompt: 系统提示词
             user_prompt: 用户提示词
+            disable_proxy: 是否绕过代理发送请求
             
         返回:
             摘要文本或错误消息
         """
         try:
-            # 创建 OpenAI 客户端配置
-            client_kwargs = {
-                'api_key': self.api_key,
-                'base_url': self.base_url,
-            }
-            
-            # 初始化 OpenAI 客户端
-            client = OpenAI(**client_kwargs)
+            # 获取缓存的 OpenAI 客户端
+            client = self._get_client(disable_proxy)
             
             # 调用模型进行文本摘要
             logger.info("发送API请求到DashScope...")
@@ -145,16 +248,16 @@ class TextSummarizer:
             filepath = os.path.join(RESULTS_DIR, filename)
             
             # 写入文件
-            with open(filepath, 'w', encoding='utf-8') as f:
-                if source_info:
-                    f.write(f"来源: {source_info}\n\n")
-                
-                f.write("==== 原文内容 ====\n\n")
-                f.write(text)
-                f.write("\n\n")
-                
-                f.write("==== 文本摘要 ====\n\n")
-                f.write(summary)
+            buf = bytearray()
+            if source_info:
+                buf += f"来源: {source_info}\n\n".encode('utf-8')
+            buf += "==== 原文内容 ====\n\n".encode('utf-8')
+            buf += text.encode('utf-8')
+            buf += "\n\n==== 文本摘要 ====\n\n".encode('utf-8')
+            buf += summary.encode('utf-8')
+            
+            with open(filepath, 'wb') as f:
+                f.write(buf)
             
             logger.info(f"摘要结果已保存到文件: {filepath}")
             return filepath
@@ -164,6 +267,11 @@ class TextSummarizer:
             return None
 
 # 方便直接使用的函数
+@functools.lru_cache(maxsize=1)
+def _default_summarizer():
+    """获取便捷函数共享的摘要器，复用其缓存的 OpenAI 客户端"""
+    return TextSummarizer()
+
 def summarize_text(text, disable_proxy=True):
     """
     对文本进行摘要的便捷函数
@@ -175,8 +283,7 @@ def summarize_text(text, disable_proxy=True):
     返回:
         摘要文本或错误消息（如果摘要失败）
     """
-    summarizer = TextSummarizer()
-    return summarizer.summarize(text, disable_proxy)
+    return _default_summarizer().summarize(text, disable_proxy)
 
 def save_summary_result(text, summary, source_info=None):
     """
@@ -190,5 +297,4 @@ def save_summary_result(text, summary, source_info=None):
     返回:
         保存的文件路径或None（如果保存失败）
     """
-    summarizer = TextSummarizer()
-    return summarizer.save_summary(text, summary, source_info) 
\ No newline at end of file
+    return _default_summarizer().save_summary(text, summary, source_info) 
\ No newline at end of file
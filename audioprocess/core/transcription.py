@@ -6,7 +6,9 @@
 """
 
 import os
+import functools
 import json
+import time
 import requests
 from http import HTTPStatus
 from datetime import datetime
@@ -15,10 +17,17 @@ import dashscope
 from dashscope.audio.asr import Transcription
 
 from audioprocess.utils.logger import get_logger
+from audioprocess.utils.http_utils import get_http_session, loads_json
 from audioprocess.config.settings import DASHSCOPE_API_KEY, RESULTS_DIR
 
 logger = get_logger(__name__)
 
+# 转录任务的终止状态
+_TERMINAL_STATUSES = frozenset(('SUCCEEDED', 'FAILED', 'CANCELED', 'UNKNOWN'))
+
+# 查询任务状态时遇到这些HTTP状态码视为暂时性错误，继续轮询
+_RETRYABLE_STATUS_CODES = frozenset((429, 500, 502, 503, 504))
+
 class AudioTranscriber:
     """音频转录器类"""
     
@@ -31,6 +40,7 @@ class AudioTranscriber:
         """
         self.api_key = api_key or os.environ.get("DASHSCOPE_API_KEY", DASHSCOPE_API_KEY)
         dashscope.api_key = self.api_key
+        self._session = get_http_session()
     
     def transcribe(self, file_url, language_hints=None):
         """
@@ -51,27 +61,8 @@ class AudioTranscriber:
                 language_hints = ['zh', 'en']
             
             # 调用 DashScope API 进行异步转录
-            task_response = Transcription.async_call(
-                model='paraformer-v2',
-                file_urls=[file_url],
-                language_hints=language_hints
-            )
-            
-            # 等待转录任务完成
-            task_id = task_response.output.task_id
-            logger.info(f"转录任务已提交，任务ID: {task_id}")
-            transcribe_response = Transcription.wait(task=task_id)
-            
-            # 处理转录结果
-            if transcribe_response.status_code == HTTPStatus.OK:
-                logger.info("转录任务成功完成")
-                return self._process_transcription_result(transcribe_response.output, file_url)
-            else:
-                logger.error(f"转录失败，状态码: {transcribe_response.status_code}")
-                logger.error(f"错误信息: {transcribe_response.message}")
-                return {
-                    'error': f"转录请求失败: 状态码 {transcribe_response.status_code} - {transcribe_response.message}"
-                }
+            task_id = self._submit(file_url, language_hints)
+            return self._collect(task_id, file_url)
                 
         except Exception as e:
             logger.error(f"转录音频时出错: {str(e)}")
@@ -79,6 +70,106 @@ class AudioTranscriber:
                 'error': f"转录处理错误: {str(e)}"
             }
     
+    def _submit(self, file_url, language_hints):
+        """
+        提交单个文件的异步转录任务
+        
+        参数:
+            file_url: 音频文件URL
+            language_hints: 语言提示
+            
+        返回:
+            任务ID
+        """
+        task_response = Transcription.async_call(
+            model='paraformer-v2',
+            file_urls=[file_url],
+            language_hints=language_hints
+        )
+        task_id = task_response.output.task_id
+        logger.info(f"转录任务已提交，任务ID: {task_id}")
+        return task_id
+    
+    def _collect(self, task_id, file_url):
+        """
+        等待转录任务结束并处理其结果
+        
+        参数:
+            task_id: 任务ID
+            file_url: 原始音频文件URL
+            
+        返回:
+            处理后的结果字典
+        """
+        try:
+            task_output = self._wait_for_task(task_id)
+        except (requests.exceptions.RequestException, RuntimeError) as e:
+            logger.error(f"查询转录任务失败: {str(e)}")
+            return {
+                'error': f"转录请求失败: {str(e)}"
+            }
+        
+        # 处理转录结果
+        logger.info("转录任务已结束")
+        return self._process_transcription_result(task_output, file_url)
+    
+    def _wait_for_task(self, task_id, base_interval=1.0, max_interval=30.0, timeout=3600.0):
+        """
+        按指数退避轮询转录任务，直到任务进入终止状态
+        
+        参数:
+            task_id: 任务ID
+            base_interval: 首次轮询间隔（秒）
+            max_interval: 轮询间隔上限（秒）
+            timeout: 等待任务结束的总时长上限（秒）
+            
+        返回:
+            任务结束时的output字典
+            
+        异常:
+            RuntimeError: 超过timeout仍未进入终止状态，或查询接口返回不可重试的错误
+        """
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            task_output = self._fetch_task_output(task_id)
+            if task_output is not None and task_output.get('task_status') in _TERMINAL_STATUSES:
+                return task_output
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                status = task_output.get('task_status') if task_output else None
+                raise RuntimeError(f"等待转录任务超时（{timeout:.0f}秒），最后状态: {status}")
+            time.sleep(min(max_interval, base_interval * (2 ** attempt), remaining))
+            attempt += 1
+    
+    def _fetch_task_output(self, task_id):
+        """
+        通过共享会话查询一次任务状态，轮询时复用keep-alive连接
+        
+        参数:
+            task_id: 任务ID
+            
+        返回:
+            任务的output字典，遇到限流或服务端暂时性错误时返回None
+            
+        异常:
+            RuntimeError: 查询接口返回其他非200状态码
+        """
+        url = f"{dashscope.base_http_api_url.rstrip('/')}/tasks/{task_id}"
+        response = self._session.get(
+            url,
+            headers={'Authorization': f"Bearer {self.api_key}"},
+            timeout=30
+        )
+        if response.status_code in _RETRYABLE_STATUS_CODES:
+            logger.warning("查询转录任务 %s 返回状态码 %s，稍后重试", task_id, response.status_code)
+            return None
+        payload = loads_json(response.content) if response.content else {}
+        if response.status_code != HTTPStatus.OK:
+            message = payload.get('message') or response.reason
+            raise RuntimeError(f"状态码 {response.status_code} - {message}")
+        return payload.get('output') or {}
+    
     def _process_transcription_result(self, transcription_result, file_url):
         """
         处理转录结果
@@ -108,7 +199,8 @@ class AudioTranscriber:
                         text = self._extract_text_from_transcription(transcription_json)
                         
                         if text:
-                            result = {'full_text': text, 'source_url': file_url}
+                            # 附带前300个字符的预览，供只需展示片段的调用方使用
+                            result = {'full_text': text, 'preview': text[:300], 'source_url': file_url}
                             
                             # 保存转录结果到本地文件
                             saved_file = self._save_transcription_result(text, file_url)
@@ -174,11 +266,11 @@ class AudioTranscriber:
         """
         try:
             logger.info(f"从URL下载JSON: {url}")
-            response = requests.get(url, timeout=30)
+            response = self._session.get(url, timeout=30)
             response.raise_for_status()
             
             # 解析JSON内容
-            json_data = response.json()
+            json_data = loads_json(response.content)
             logger.info("JSON下载并解析成功")
             return json_data
             
@@ -237,12 +329,13 @@ class AudioTranscriber:
             filepath = os.path.join(RESULTS_DIR, filename)
             
             # 写入文件
-            with open(filepath, 'w', encoding='utf-8') as f:
-                if source_url:
-                    f.write(f"音频来源: {source_url}\n\n")
-                
-                f.write("==== 转录文本 ====\n\n")
-                f.write(text)
+            parts = []
+            if source_url:
+                parts.append(f"音频来源: {source_url}\n\n")
+            parts.extend(("==== 转录文本 ====\n\n", text))
+            
+            with open(filepath, 'wb') as f:
+                f.write("".join(parts).encode('utf-8'))
             
             logger.info(f"转录结果已保存到文件: {filepath}")
             return filepath
@@ -252,6 +345,11 @@ class AudioTranscriber:
             return None
 
 # 方便直接使用的函数
+@functools.lru_cache(maxsize=1)
+def _default_transcriber():
+    """获取便捷函数共享的转录器"""
+    return AudioTranscriber()
+
 def transcribe_audio(file_url, language_hints=None):
     """
     转录音频文件的便捷函数
@@ -263,5 +361,4 @@ def transcribe_audio(file_url, language_hints=None):
     返回:
         字典，包含转录文本和相关信息，如果转录失败则包含错误信息
     """
-    transcriber = AudioTranscriber()
-    return transcriber.transcribe(file_url, language_hints) 
\ No newline at end of file
+    return _default_transcriber().transcribe(file_url, language_hints) 
\ No newline at end of file
@@ -6,15 +6,105 @@ YouTube 音频下载模块
 """
 
 import os
-import yt_dlp
+import re
+import queue
+import shutil
+import threading
+import time
 from pathlib import Path
 
 from audioprocess.utils.logger import get_logger
+from audioprocess.core import _ytdl_cache
 from audioprocess.utils.proxy_manager import get_http_proxy
+from audioprocess.utils.file_utils import ensure_dir_once
 from audioprocess.config.settings import DOWNLOADS_DIR
 
 logger = get_logger(__name__)
 
+# 分片流（HLS/DASH）并发下载的分片数
+CONCURRENT_FRAGMENTS = int(os.environ.get("YTDLP_CONCURRENT_FRAGS", "8"))
+
+# 从Chrome导出的cookies文件及其有效期（秒）
+# 文件包含登录凭据，放在仅当前用户可访问的缓存目录中，不能放在机器人发送文件的下载目录
+COOKIE_DIR = os.environ.get(
+    "AUDIOPROCESS_CACHE_DIR",
+    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "audioprocess")
+)
+COOKIE_FILE = os.path.join(COOKIE_DIR, 'cookies.txt')
+COOKIE_MAX_AGE = 3600
+# 只导出下载YouTube所需域名的cookies
+COOKIE_DOMAINS = ('youtube.com', 'google.com')
+
+# 从YouTube链接中提取11位视频ID，作为视频信息缓存的键
+_VIDEO_ID_RE = re.compile(r'(?:youtube(?:-nocookie)?\.com/(?:watch\?(?:.*&)?v=|embed/|v/|shorts/)|youtu\.be/)([A-Za-z0-9_-]{11})')
+
+def _cookie_file_fresh():
+    try:
+        return time.time() - os.stat(COOKIE_FILE).st_mtime < COOKIE_MAX_AGE
+    except FileNotFoundError:
+        return False
+
+def _is_youtube_cookie(cookie):
+    domain = cookie.domain.lstrip('.')
+    return any(domain == d or domain.endswith('.' + d) for d in COOKIE_DOMAINS)
+
+def _ensure_cookie_file():
+    """
+    确保存在未过期的cookies文件，过期或不存在时从Chrome重新导出
+    
+    多个进程同时刷新时通过文件锁串行化，只有一个进程会读取Chrome的cookie库
+    
+    返回:
+        cookies文件路径，导出失败时返回None
+    """
+    if _cookie_file_fresh():
+        return COOKIE_FILE
+    
+    try:
+        import fcntl
+    except ImportError:  # Windows没有fcntl，退化为不加锁
+        fcntl = None
+    
+    try:
+        os.makedirs(COOKIE_DIR, mode=0o700, exist_ok=True)
+        with open(f"{COOKIE_FILE}.lock", 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # 等待锁期间其他进程可能已经刷新过
+            if _cookie_file_fresh():
+                return COOKIE_FILE
+            
+            logger.info("从Chrome导出cookies到: %s", COOKIE_FILE)
+            from yt_dlp.cookies import extract_cookies_from_browser
+            jar = extract_cookies_from_browser('chrome')
+            youtube_jar = type(jar)()
+            for cookie in jar:
+                if _is_youtube_cookie(cookie):
+                    youtube_jar.set_cookie(cookie)
+            
+            # 先以0600权限创建临时文件，save()以写模式打开已存在的文件时会保留该权限
+            tmp_path = f"{COOKIE_FILE}.{os.getpid()}.tmp"
+            try:
+                os.unlink(tmp_path)  # 上次异常退出遗留的临时文件权限不可信
+            except FileNotFoundError:
+                pass
+            os.close(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+            youtube_jar.save(tmp_path, ignore_discard=True, ignore_expires=True)
+            os.replace(tmp_path, COOKIE_FILE)
+            
+            # 删除旧版本导出到下载目录中的cookies文件
+            try:
+                os.remove(os.path.join(DOWNLOADS_DIR, '.cookies.txt'))
+            except FileNotFoundError:
+                pass
+            return COOKIE_FILE
+    except Exception as e:
+        logger.warning("导出Chrome cookies失败，改为每次从浏览器读取: %s", e)
+        return None
+
+class DownloadCancelled(Exception):
+    """下载器已被取消，由进度回调抛出以中止正在进行的下载"""
+
 class YouTubeDownloader:
     """YouTube音频下载器类"""
     
@@ -28,9 +118,20 @@ class YouTubeDownloader:
         """
         self.output_path = output_path or DOWNLOADS_DIR
         self.proxy = proxy
+        self._outtmpl = str(Path(self.output_path) / '%(title)s.%(ext)s')
+        # 代理在实例生命周期内不变，只解析一次
+        self._proxy = get_http_proxy(proxy)
+        # 空闲的YoutubeDL实例池，元素为(创建时间, 实例)
+        # YoutubeDL不是线程安全的，每次下载独占一个实例
+        self._ydl_pool = queue.SimpleQueue()
+        # 记录当前线程最近一次下载完成的文件路径（由进度回调写入）
+        self._local = threading.local()
+        # 调用cancel()后，进行中的下载在下一次进度回调时中止，之后的下载直接返回
+        self._cancelled = threading.Event()
+        self._ydl_opts_template = self._build_ydl_opts_template()
         
-        # 确保输出目录存在
-        os.makedirs(self.output_path, exist_ok=True)
+        # 确保输出目录存在（每个路径只在首次构造时创建）
+        ensure_dir_once(self.output_path)
     
     def download(self, url):
         """
@@ -46,60 +147,205 @@ class YouTubeDownloader:
             logger.error("无效的URL")
             return None
         
+        return self._download_sync(url)
+    
+    def _download_sync(self, url):
+        """
+        在当前线程中同步执行下载（会阻塞直到下载结束）
+        
+        参数:
+            url: YouTube视频URL
+            
+        返回:
+            下载文件的路径或None（如果下载失败）
+        """
+        try:
+            # 从实例池取出YoutubeDL，避免每次下载重新初始化
+            created_at, ydl = self._acquire_ydl()
+        except Exception as e:
+            logger.error("下载错误: %s", e)
+            return None
+        
         try:
-            # 配置yt-dlp选项
-            ydl_opts = self._get_ydl_opts()
+            logger.info("开始从URL下载: %s", url)
             
-            # 下载音频
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                logger.info(f"开始从URL下载: {url}")
+            try:
+                # 尝试提取视频信息并下载
+                self._local.last_path = None
+                info = self._extract_and_download(ydl, url)
                 
-                try:
-                    # 尝试提取视频信息并下载
-                    info = ydl.extract_info(url, download=True)
-                    
-                    if not info:
-                        logger.error("无法获取视频信息")
-                        return None
-                    
-                    # 获取下载的文件名
-                    filename = ydl.prepare_filename(info)
-                    
-                    if os.path.exists(filename):
-                        logger.info(f"下载完成: {filename}")
-                        return filename
-                    else:
-                        logger.error(f"下载完成但文件不存在: {filename}")
-                        return None
+                if not info:
+                    logger.error("无法获取视频信息")
+                    return None
                 
-                except Exception as inner_e:
-                    logger.warning(f"下载失败: {str(inner_e)}")
-                    logger.info("尝试下载公开视频...")
-                    return self._try_fallback_download(ydl)
+                filename = self._downloaded_path(ydl, info)
+                if filename:
+                    logger.info("下载完成: %s", filename)
+                    return filename
+                else:
+                    logger.error("下载完成但文件不存在: %s", ydl.prepare_filename(info))
+                    return None
+            
+            except Exception as inner_e:
+                # 取消可能以DownloadCancelled抛出，也可能被yt-dlp包装成其他异常
+                if self._cancelled.is_set():
+                    logger.info("下载已取消: %s", url)
+                    return None
+                logger.warning("下载失败: %s", inner_e)
+                logger.info("尝试下载公开视频...")
+                return self._try_fallback_download(ydl)
                 
         except Exception as e:
-            logger.error(f"下载错误: {str(e)}")
+            logger.error("下载错误: %s", e)
             return None
+        finally:
+            self._ydl_pool.put((created_at, ydl))
     
-    def _get_ydl_opts(self):
-        """获取yt-dlp选项配置"""
+    def _downloaded_path(self, ydl, info):
+        """
+        获取本次下载生成的文件路径
+        
+        参数:
+            ydl: YoutubeDL实例
+            info: process_ie_result返回的视频信息字典
+            
+        返回:
+            文件路径，没有生成文件时返回None
+        """
+        # yt-dlp在文件写完时通过进度回调报告路径，此时无需再检查文件
+        if self._local.last_path:
+            return self._local.last_path
+        filename = ydl.prepare_filename(info)
+        return filename if os.path.exists(filename) else None
+    
+    def cancel(self):
+        """取消该下载器上进行中和之后的下载"""
+        self._cancelled.set()
+    
+    def _on_progress(self, status):
+        """yt-dlp进度回调，记录下载完成的文件路径；下载器已取消时中止下载"""
+        if self._cancelled.is_set():
+            raise DownloadCancelled()
+        if status.get('status') == 'finished':
+            self._local.last_path = status.get('filename')
+    
+    def _acquire_ydl(self):
+        """
+        从实例池中取出一个空闲的YoutubeDL实例，池为空时新建
+        
+        实例在创建时加载cookies，超过cookies有效期的实例会被关闭并重建
+        
+        返回:
+            (创建时间, YoutubeDL实例)
+        """
+        while True:
+            try:
+                created_at, ydl = self._ydl_pool.get_nowait()
+            except queue.Empty:
+                break
+            if time.time() - created_at < COOKIE_MAX_AGE:
+                return created_at, ydl
+            ydl.close()
+        # yt_dlp导入时会加载全部提取器，推迟到第一次真正下载时再导入
+        import yt_dlp
+        return time.time(), yt_dlp.YoutubeDL(self._get_ydl_opts())
+    
+    def close(self):
+        """关闭实例池中所有空闲的YoutubeDL实例"""
+        while True:
+            try:
+                _, ydl = self._ydl_pool.get_nowait()
+            except queue.Empty:
+                break
+            ydl.close()
+    
+    def _extract_and_download(self, ydl, url):
+        """
+        获取视频信息并下载，优先使用缓存的视频信息跳过页面解析
+        
+        参数:
+            ydl: YoutubeDL实例
+            url: YouTube视频URL
+            
+        返回:
+            处理后的视频信息字典或None
+        """
+        match = _VIDEO_ID_RE.search(url)
+        video_id = match.group(1) if match else None
+        
+        if video_id:
+            cached_info = _ytdl_cache.load(video_id)
+            if cached_info is not None:
+                logger.info("使用缓存的视频信息: %s", video_id)
+                try:
+                    info = ydl.process_ie_result(cached_info, download=True)
+                except DownloadCancelled:
+                    raise
+                except Exception as e:
+                    logger.warning("使用缓存的视频信息下载出错: %s", e)
+                    info = None
+                # ignoreerrors开启时下载错误（如媒体地址过期返回403）不会抛出异常，
+                # 以是否生成了文件判断成功与否
+                if info and self._downloaded_path(ydl, info):
+                    return info
+                # 缓存的媒体地址可能已失效，清除缓存后重新解析一次
+                if self._cancelled.is_set():
+                    raise DownloadCancelled()
+                logger.warning("使用缓存的视频信息未能下载文件，重新解析: %s", video_id)
+                _ytdl_cache.invalidate(video_id)
+                self._local.last_path = None
+        
+        info = ydl.extract_info(url, download=False)
+        if not info:
+            return None
+        
+        info = ydl.sanitize_info(info, remove_private_keys=True)
+        if video_id:
+            _ytdl_cache.store(video_id, info)
+        return ydl.process_ie_result(info, download=True)
+    
+    def _build_ydl_opts_template(self):
+        """构建不随调用变化的yt-dlp选项，只在初始化时执行一次"""
         ydl_opts = {
             'format': 'bestaudio/best',
-            'outtmpl': os.path.join(self.output_path, '%(title)s.%(ext)s'),
+            'outtmpl': self._outtmpl,
             'quiet': False,
             'no_warnings': False,
-            'cookiesfrombrowser': ('chrome',),  # 从Chrome浏览器中获取cookies
             'skip_download': False,
             'simulate': False,
             'extractaudio': True,
             'ignoreerrors': True,
-            'no_warnings': True
+            'no_warnings': True,
+            'noprogress': True,
+            # 并发下载分片，并增大单个HTTP请求的分块
+            'concurrent_fragment_downloads': CONCURRENT_FRAGMENTS,
+            'http_chunk_size': 10 << 20,
+            'retries': 3,
+            'fragment_retries': 3,
+            'progress_hooks': [self._on_progress]
         }
         
+        # 安装了aria2c时使用多连接下载单个文件
+        if shutil.which('aria2c'):
+            ydl_opts['external_downloader'] = 'aria2c'
+            ydl_opts['external_downloader_args'] = ['-x', '8', '-s', '8', '-k', '1M']
+        
         # 处理代理设置
-        proxy = get_http_proxy(self.proxy)
-        if proxy:
-            ydl_opts['proxy'] = proxy
+        if self._proxy:
+            ydl_opts['proxy'] = self._proxy
+        
+        return ydl_opts
+    
+    def _get_ydl_opts(self):
+        """获取yt-dlp选项配置"""
+        ydl_opts = dict(self._ydl_opts_template)
+        
+        # 优先使用定期从Chrome导出的cookies文件，导出失败时直接从浏览器读取
+        cookie_file = _ensure_cookie_file()
+        if cookie_file:
+            ydl_opts['cookiefile'] = cookie_file
+        else:
+            ydl_opts['cookiesfrombrowser'] = ('chrome',)
         
         return ydl_opts
     
@@ -108,25 +354,38 @@ class YouTubeDownloader:
         public_url = "https://www.youtube.com/watch?v=jNQXAC9IVRw"  # YouTube第一个视频
         
         try:
-            info = ydl.extract_info(public_url, download=True)
+            self._local.last_path = None
+            info = self._extract_and_download(ydl, public_url)
             
             if not info:
                 logger.error("无法获取公开视频信息")
                 return None
             
-            filename = ydl.prepare_filename(info)
-            
-            if os.path.exists(filename):
-                logger.info(f"公开视频下载完成: {filename}")
+            filename = self._downloaded_path(ydl, info)
+            if filename:
+                logger.info("公开视频下载完成: %s", filename)
                 return filename
             else:
-                logger.error(f"公开视频下载完成但文件不存在: {filename}")
+                logger.error("公开视频下载完成但文件不存在: %s", ydl.prepare_filename(info))
                 return None
                 
         except Exception as e:
-            logger.error(f"备选下载也失败: {str(e)}")
+            logger.error("备选下载也失败: %s", e)
             return None
 
+# 便捷函数共享的下载器，按(输出目录, 代理)区分
+_DOWNLOADER_CACHE = {}
+_DOWNLOADER_CACHE_LOCK = threading.Lock()
+
+def _get_downloader(output_path, proxy):
+    """获取（必要时创建）指定输出目录和代理的共享下载器"""
+    key = (output_path or DOWNLOADS_DIR, proxy)
+    with _DOWNLOADER_CACHE_LOCK:
+        downloader = _DOWNLOADER_CACHE.get(key)
+        if downloader is None:
+            downloader = _DOWNLOADER_CACHE[key] = YouTubeDownloader(*key)
+    return downloader
+
 # 方便直接使用的函数
 def download_audio_from_youtube(url, output_path=None, proxy=None):
     """
@@ -140,5 +399,4 @@ def download_audio_from_youtube(url, output_path=None, proxy=None):
     返回:
         下载文件的路径或None（如果下载失败）
     """
-    downloader = YouTubeDownloader(output_path, proxy)
-    return downloader.download(url) 
\ No newline at end of file
+    return _get_downloader(output_path, proxy).download(url) 
\ No newline at end of file
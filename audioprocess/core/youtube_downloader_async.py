@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+YouTube 异步音频下载模块
+---------------------
+在有界线程池中执行yt-dlp下载，提供asyncio接口，下载时不阻塞事件循环
+"""
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from audioprocess.utils.logger import get_logger
+from audioprocess.core.youtube_downloader import _get_downloader
+
+logger = get_logger(__name__)
+
+# 同时进行的下载数上限，避免触发YouTube限流
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get("YTDL_WORKERS", "4"))
+
+# 所有异步下载器共享的下载线程池
+_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix="ytdl")
+
+class AsyncYouTubeDownloader:
+    """YouTube音频异步下载器类"""
+    
+    def __init__(self, output_path=None, proxy=None, executor=None):
+        """
+        初始化异步下载器
+        
+        参数:
+            output_path: 下载文件保存路径，默认使用配置中的下载目录
+            proxy: 可选的代理设置，格式如http://127.0.0.1:7890
+            executor: 执行下载的线程池，默认使用模块共享的有界线程池
+        """
+        # 复用同步便捷函数共享的下载器，共用YoutubeDL实例池
+        self._downloader = _get_downloader(output_path, proxy)
+        self._executor = executor or _EXECUTOR
+    
+    async def download(self, url):
+        """
+        从YouTube下载音频，下载在线程池中执行，不阻塞事件循环
+        
+        参数:
+            url: YouTube视频URL
+            
+        返回:
+            下载文件的路径或None（如果下载失败）
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._downloader.download, url)
+
+# 方便直接使用的函数
+async def download_audio_from_youtube_async(url, output_path=None, proxy=None):
+    """
+    异步从YouTube下载音频的便捷函数
+    
+    参数:
+        url: YouTube视频URL
+        output_path: 下载文件保存路径
+        proxy: 可选的代理设置
+        
+    返回:
+        下载文件的路径或None（如果下载失败）
+    """
+    downloader = AsyncYouTubeDownloader(output_path, proxy)
+    return await downloader.download(url)
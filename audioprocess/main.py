@@ -12,21 +12,44 @@ YouTube 视频处理主程序
 
 import os
 import sys
+import shutil
 import argparse
+import functools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from audioprocess.utils.logger import get_logger
 from audioprocess.utils.proxy_manager import disable_all_proxies
 from audioprocess.utils.file_utils import read_text_file
 
-from audioprocess.core.youtube_downloader import download_audio_from_youtube
-from audioprocess.core.oss_uploader import upload_file_to_oss
-from audioprocess.core.subtitle_extractor import extract_youtube_subtitles
-from audioprocess.core.transcription import transcribe_audio
-from audioprocess.core.summarization import summarize_text, save_summary_result
+# 核心模块依赖 yt_dlp、oss2、dashscope、openai 等较重的库，
+# 在各处理函数内按需导入，只做文本摘要时不必加载下载和转录相关的依赖
 
 logger = get_logger(__name__)
 
-def process_youtube_video(url, force_audio=False, skip_summary=False, youtube_proxy=None):
+def _prefetch_audio(downloader, url):
+    """
+    使用本任务专用的下载器预取音频，结束后关闭下载器
+    
+    参数:
+        downloader: 输出到本任务临时目录的下载器，取消时只影响本任务
+        url: YouTube 视频 URL
+        
+    返回:
+        下载文件的路径或None
+    """
+    try:
+        return downloader.download(url)
+    finally:
+        downloader.close()
+
+def _discard_prefetched_audio(prefetch_dir, future):
+    """删除字幕提取成功后不再需要的预取音频，只清理本任务创建的临时目录"""
+    shutil.rmtree(prefetch_dir, ignore_errors=True)
+    if not future.cancelled() and future.exception() is None and future.result():
+        logger.info("已删除未使用的预取音频: %s", future.result())
+
+def process_youtube_video(url, force_audio=False, skip_summary=False, youtube_proxy=None, prefetch_audio=False):
     """
     处理 YouTube 视频：尝试提取字幕，或下载音频并转录，然后生成摘要
     
@@ -35,21 +58,45 @@ def process_youtube_video(url, force_audio=False, skip_summary=False, youtube_pr
         force_audio: 是否强制使用音频下载和转录流程
         skip_summary: 是否跳过摘要步骤
         youtube_proxy: YouTube 下载专用代理
+        prefetch_audio: 是否在提取字幕的同时预先下载音频，字幕不可用时可省去下载等待，
+            字幕可用时会多消耗一次下载流量
         
     返回:
         处理结果字典
     """
+    from audioprocess.core.youtube_downloader import download_audio_from_youtube, YouTubeDownloader
+    from audioprocess.core.subtitle_extractor import extract_youtube_subtitles
+    from audioprocess.core.summarization import summarize_text, save_summary_result
+    
     result = {'success': False}
     
+    # 预取音频：与字幕提取并行下载，字幕可用时立即取消并丢弃
+    # 下载到本任务私有的临时目录，丢弃时不会误删其他任务正在使用的同名文件
+    audio_future = None
+    if prefetch_audio and not force_audio:
+        prefetch_dir = tempfile.mkdtemp(prefix="audio-prefetch-")
+        prefetch_downloader = YouTubeDownloader(output_path=prefetch_dir, proxy=youtube_proxy)
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-prefetch")
+        audio_future = executor.submit(_prefetch_audio, prefetch_downloader, url)
+        executor.shutdown(wait=False)
+    
     # 1. 尝试提取字幕（除非强制使用音频流程）
     if not force_audio:
         logger.info("尝试从 YouTube 视频中提取字幕...")
         subtitle_result = extract_youtube_subtitles(url, proxy=youtube_proxy)
         
         if subtitle_result:
-            logger.info(f"成功提取字幕，语言: {subtitle_result['language']}")
+            logger.info("成功提取字幕，语言: %s", subtitle_result['language'])
+            
+            # 字幕可用，不再需要预取的音频：中止下载，结束后清理临时目录
+            if audio_future is not None:
+                prefetch_downloader.cancel()
+                audio_future.cancel()
+                audio_future.add_done_callback(functools.partial(_discard_prefetched_audio, prefetch_dir))
+            
             result['subtitle_extracted'] = True
             result['text'] = subtitle_result['text']
+            result['preview'] = subtitle_result.get('preview')
             result['subtitle_file'] = subtitle_result['subtitle_file']
             result['language'] = subtitle_result['language']
             
@@ -79,14 +126,43 @@ def process_youtube_video(url, force_audio=False, skip_summary=False, youtube_pr
             logger.info("未找到字幕或提取失败，将使用音频下载和转录流程")
     
     # 3. 如果没有找到字幕或被指示使用音频流程，继续原有流程
-    # 从 YouTube 下载音频
-    audio_file = download_audio_from_youtube(url, proxy=youtube_proxy)
+    if audio_future is None:
+        # 从 YouTube 下载音频
+        audio_file = download_audio_from_youtube(url, proxy=youtube_proxy)
+        return _process_audio_file(url, audio_file, result, skip_summary)
+    
+    # 已预取时直接等待预取结果；预取目录只属于本次处理，任何退出路径都会删除，
+    # 因此结果中不记录其中的音频路径
+    try:
+        return _process_audio_file(url, audio_future.result(), result, skip_summary, keep_path=False)
+    finally:
+        shutil.rmtree(prefetch_dir, ignore_errors=True)
+
+def _process_audio_file(url, audio_file, result, skip_summary, keep_path=True):
+    """
+    上传并转录已下载的音频文件，然后生成摘要
+    
+    参数:
+        url: YouTube 视频 URL
+        audio_file: 下载的音频文件路径，下载失败时为None
+        result: 处理结果字典，会被原地更新
+        skip_summary: 是否跳过摘要步骤
+        keep_path: 是否在结果中记录音频文件路径，文件处理后会被删除时为False
+        
+    返回:
+        处理结果字典
+    """
+    from audioprocess.core.oss_uploader import upload_file_to_oss
+    from audioprocess.core.transcription import transcribe_audio
+    from audioprocess.core.summarization import summarize_text, save_summary_result
+    
     if not audio_file:
         logger.error("音频下载失败")
         result['error'] = "音频下载失败"
         return result
     
-    result['audio_file'] = audio_file
+    if keep_path:
+        result['audio_file'] = audio_file
     
     # 4. 将音频文件上传到阿里云 OSS
     oss_url = upload_file_to_oss(audio_file)
@@ -101,11 +177,12 @@ def process_youtube_video(url, force_audio=False, skip_summary=False, youtube_pr
     transcription_result = transcribe_audio(oss_url)
     
     if 'error' in transcription_result:
-        logger.error(f"音频转录失败: {transcription_result['error']}")
+        logger.error("音频转录失败: %s", transcription_result['error'])
         result['error'] = f"音频转录失败: {transcription_result['error']}"
         return result
     
     result['text'] = transcription_result['full_text']
+    result['preview'] = transcription_result.get('preview')
     result['transcription_file'] = transcription_result.get('saved_file')
     
     # 6. 对转录内容生成摘要（除非指定跳过）
@@ -142,17 +219,21 @@ def process_direct_oss_url(oss_url, skip_summary=False):
     返回:
         处理结果字典
     """
+    from audioprocess.core.transcription import transcribe_audio
+    from audioprocess.core.summarization import summarize_text, save_summary_result
+    
     result = {'success': False}
     
     # 1. 转录音频文件
     transcription_result = transcribe_audio(oss_url)
     
     if 'error' in transcription_result:
-        logger.error(f"音频转录失败: {transcription_result['error']}")
+        logger.error("音频转录失败: %s", transcription_result['error'])
         result['error'] = f"音频转录失败: {transcription_result['error']}"
         return result
     
     result['text'] = transcription_result['full_text']
+    result['preview'] = transcription_result.get('preview')
     result['transcription_file'] = transcription_result.get('saved_file')
     
     # 2. 对转录内容生成摘要（除非指定跳过）
@@ -189,6 +270,8 @@ def process_direct_text(text, source_description="直接文本输入"):
     返回:
         处理结果字典
     """
+    from audioprocess.core.summarization import summarize_text, save_summary_result
+    
     result = {'success': False}
     
     if not text:
@@ -205,7 +288,7 @@ def process_direct_text(text, source_description="直接文本输入"):
         result['error'] = "摘要生成失败: 未返回结果"
         return result
     elif summary.startswith("摘要生成失败"):
-        logger.error(f"摘要生成失败: {summary}")
+        logger.error("摘要生成失败: %s", summary)
         result['error'] = summary
         return result
     
@@ -228,46 +311,52 @@ def print_result(result):
     参数:
         result: 处理结果字典
     """
-    print("\n---------------------------------------")
+    # 先拼好整段输出，再一次性写入标准输出
+    parts = ["\n---------------------------------------\n"]
     
     if not result['success']:
-        print(f"处理失败: {result.get('error', '未知错误')}")
-        print("---------------------------------------\n")
+        parts.append(f"处理失败: {result.get('error', '未知错误')}\n")
+        parts.append("---------------------------------------\n\n")
+        sys.stdout.write("".join(parts))
+        sys.stdout.flush()
         return
     
     # 如果有字幕或音频文件，则显示
     if 'subtitle_extracted' in result and result['subtitle_extracted']:
-        print(f"已提取 YouTube 字幕，语言: {result.get('language', '未知')}")
-        print(f"字幕文件保存于: {result.get('subtitle_file', '未知')}")
-    elif 'audio_file' in result:
-        print(f"已下载音频: {result['audio_file']}")
+        parts.append(f"已提取 YouTube 字幕，语言: {result.get('language', '未知')}\n")
+        parts.append(f"字幕文件保存于: {result.get('subtitle_file', '未知')}\n")
+    elif 'audio_file' in result or 'oss_url' in result:
+        if 'audio_file' in result:
+            parts.append(f"已下载音频: {result['audio_file']}\n")
         
         if 'oss_url' in result:
-            print(f"已上传到 OSS，URL: {result['oss_url']}")
+            parts.append(f"已上传到 OSS，URL: {result['oss_url']}\n")
     
     # 显示文本内容（截断）
     if 'text' in result:
-        print("\n原始文本片段:")
+        parts.append("\n原始文本片段:\n")
         text = result['text']
-        # 只显示前300个字符
-        display_text = text[:300] + ("..." if len(text) > 300 else "")
-        print(display_text)
+        # 只显示前300个字符，优先使用生产方已截好的预览
+        preview = result.get('preview') or text[:300]
+        parts.append(preview + ("..." if len(text) > len(preview) else "") + "\n")
         
         if 'transcription_file' in result:
-            print(f"\n完整转录保存于: {result['transcription_file']}")
+            parts.append(f"\n完整转录保存于: {result['transcription_file']}\n")
     
     # 显示摘要
     if 'summary' in result:
-        print("\n文本摘要:")
-        print(result['summary'])
+        parts.append("\n文本摘要:\n")
+        parts.append(f"{result['summary']}\n")
         
         if 'summary_file' in result:
-            print(f"\n完整摘要和原文保存于: {result['summary_file']}")
+            parts.append(f"\n完整摘要和原文保存于: {result['summary_file']}\n")
     elif 'summary_error' in result:
-        print("\n摘要生成失败:")
-        print(result['summary_error'])
+        parts.append("\n摘要生成失败:\n")
+        parts.append(f"{result['summary_error']}\n")
     
-    print("---------------------------------------\n")
+    parts.append("---------------------------------------\n\n")
+    sys.stdout.write("".join(parts))
+    sys.stdout.flush()
 
 def main():
     """主函数"""
@@ -278,6 +367,7 @@ def main():
     parser.add_argument('--url', type=str, help='YouTube 视频 URL')
     parser.add_argument('--youtube-proxy', type=str, help='YouTube下载专用代理，格式如http://127.0.0.1:7890')
     parser.add_argument('--force-audio', action='store_true', help='强制使用音频下载和转录流程，即使有字幕')
+    parser.add_argument('--prefetch-audio', action='store_true', help='提取字幕的同时预先下载音频，字幕不可用时减少等待')
     
     # OSS直接测试参数
     parser.add_argument('--oss-url', type=str, help='OSS 音频文件 URL, 直接用于语音识别测试')
@@ -308,12 +398,12 @@ def main():
             source_description = "命令行输入文本"
         elif args.text_file:
             # 从文件读取文本
-            logger.info(f"从文件读取文本进行摘要测试: {args.text_file}")
+            logger.info("从文件读取文本进行摘要测试: %s", args.text_file)
             text_to_summarize = read_text_file(args.text_file)
             source_description = f"文件: {args.text_file}"
             
             if not text_to_summarize:
-                logger.error(f"无法读取文件: {args.text_file}")
+                logger.error("无法读取文件: %s", args.text_file)
                 return 1
         
         # 处理文本并生成摘要
@@ -323,7 +413,7 @@ def main():
     
     # 2. 处理 OSS URL 直接测试
     if args.oss_url:
-        logger.info(f"直接使用 OSS URL 进行语音识别测试: {args.oss_url}")
+        logger.info("直接使用 OSS URL 进行语音识别测试: %s", args.oss_url)
         result = process_direct_oss_url(args.oss_url, skip_summary=args.skip_summary)
         print_result(result)
         return 0 if result['success'] else 1
@@ -334,14 +424,15 @@ def main():
     else:
         # 使用测试 URL
         youtube_url = "https://www.youtube.com/watch?v=jNQXAC9IVRw"  # YouTube 第一个视频
-        logger.info(f"使用测试 URL: {youtube_url}")
+        logger.info("使用测试 URL: %s", youtube_url)
     
     # 处理 YouTube 视频
     result = process_youtube_video(
         youtube_url,
         force_audio=args.force_audio,
         skip_summary=args.skip_summary,
-        youtube_proxy=args.youtube_proxy
+        youtube_proxy=args.youtube_proxy,
+        prefetch_audio=args.prefetch_audio
     )
     
     print_result(result)
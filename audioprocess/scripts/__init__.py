@@ -0,0 +1,3 @@
+"""
+脚本模块
+"""
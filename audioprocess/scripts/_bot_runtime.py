@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+机器人运行时公共模块
+------------------
+独立机器人脚本共用的日志配置、错误处理和启动流程
+"""
+
+import os
+import queue
+import atexit
+import logging
+import logging.handlers
+import traceback
+from functools import wraps
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
+
+from audioprocess.config.settings import TELEGRAM_ALLOWED_USERS
+
+logger = logging.getLogger(__name__)
+
+# Telegram Bot API允许上传的最大文件大小
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+# Webhook配置：设置WEBHOOK_URL（对外可访问的HTTPS地址）后使用webhook接收更新，否则使用轮询
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+
+def parse_allowed_users(value):
+    """
+    解析允许使用机器人的用户ID配置
+
+    参数:
+        value: 逗号分隔的字符串或用户ID列表，空白和非数字条目会被忽略
+
+    返回:
+        整数用户ID的frozenset，可直接与update.effective_user.id比较
+    """
+    if isinstance(value, str):
+        value = value.split(',')
+    users = (str(u).strip() for u in value or ())
+    return frozenset(int(u) for u in users if u.isdigit())
+
+# 允许使用机器人的用户ID集合，模块加载时构建一次
+# 未配置或配置为空时拒绝所有用户，必须显式列出允许使用的用户ID
+ALLOWED_USERS = parse_allowed_users(TELEGRAM_ALLOWED_USERS)
+
+def setup_logging(log_file):
+    """
+    配置日志：处理线程只把日志记录放入队列，由后台监听线程统一写入控制台和文件
+
+    参数:
+        log_file: 日志文件路径
+
+    返回:
+        已启动的QueueListener，进程退出时会自动停止并写完队列中剩余的日志
+    """
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(
+        log_queue,
+        logging.StreamHandler(),
+        logging.FileHandler(log_file),
+        respect_handler_level=True
+    )
+    listener.start()
+    # 无论通过 python -m 还是安装后的命令行入口启动，退出时都会执行
+    atexit.register(listener.stop)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        handlers=[logging.handlers.QueueHandler(log_queue)]
+    )
+    return listener
+
+def safe_reply(update, text, **kwargs):
+    """
+    尽力回复用户消息，发送失败只记录调试日志，不向上抛出异常
+
+    参数:
+        update: Telegram Update对象，可以为None
+        text: 回复内容
+        **kwargs: 透传给reply_text的其他参数
+    """
+    message = update and update.effective_message
+    if not message:
+        return
+    try:
+        message.reply_text(text, **kwargs)
+    except Exception:
+        logger.debug("回复消息失败", exc_info=True)
+
+def require_auth(denied_state=None):
+    """
+    检查用户是否有权限使用机器人的装饰器，所有机器人共用同一个允许列表
+
+    参数:
+        denied_state: 用户无权限时处理函数的返回值（会话状态）
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(update, context):
+            user_id = update.effective_user.id
+            if user_id not in ALLOWED_USERS:
+                logger.warning("用户 %s 尝试访问 %s，但不在允许列表中", user_id, func.__name__)
+                safe_reply(update, "抱歉，您没有权限使用此机器人。")
+                return denied_state
+            return func(update, context)
+        return wrapper
+    return decorator
+
+def log_allowed_users():
+    """启动时记录允许列表，未配置时提示所有用户都会被拒绝"""
+    if ALLOWED_USERS:
+        logger.info("允许的用户ID列表: %s", sorted(ALLOWED_USERS))
+    else:
+        logger.warning("未配置TELEGRAM_ALLOWED_USERS，所有用户都将被拒绝")
+
+def error_handler(update, context):
+    """处理错误"""
+    logger.error("更新 %s 导致错误 %s", update, context.error)
+    safe_reply(update, "发生错误，请稍后重试。")
+
+def start_receiving_updates(updater, bot_token, bot_name):
+    """
+    开始接收更新：设置了WEBHOOK_URL时由Telegram推送更新，否则使用轮询
+
+    参数:
+        updater: 已注册好处理器的Updater
+        bot_token: 机器人Token，同时用作webhook的URL路径，避免路径被猜到
+        bot_name: 机器人名称，用于日志输出
+    """
+    if WEBHOOK_URL:
+        logger.info(f"启动{bot_name}webhook...")
+        # 传入webhook_url时PTB会自动调用set_webhook注册地址
+        updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=bot_token,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{bot_token}",
+            drop_pending_updates=True
+        )
+        logger.info(f"{bot_name}webhook已启动，监听端口: {WEBHOOK_PORT}")
+        return
+
+    # 先删除webhook以确保轮询模式可以工作
+    logger.info("删除webhook...")
+    updater.bot.delete_webhook()
+
+    # 启动轮询，设置drop_pending_updates=True避免处理积压的消息
+    logger.info(f"启动{bot_name}轮询...")
+    updater.start_polling(drop_pending_updates=True)
+
+def run_bot(token, bot_name, commands, cmd_handlers, msg_handler, workers=4):
+    """
+    创建Updater、注册处理器并运行机器人（webhook或轮询），直到进程收到退出信号
+
+    参数:
+        token: Telegram Bot Token
+        bot_name: 机器人名称，用于日志输出
+        commands: BotCommand列表，显示在输入框左侧的命令菜单
+        cmd_handlers: {命令名: 处理函数} 字典
+        msg_handler: 非命令文本消息的处理函数
+        workers: Dispatcher工作线程数，限制通过run_async并发执行的后台任务数量
+
+    返回:
+        int: 退出码，正常退出为0，启动失败为1
+    """
+    try:
+        # 创建Updater和Dispatcher
+        logger.info("创建Updater和Dispatcher")
+        updater = Updater(token, workers=workers, use_context=True)
+        dispatcher = updater.dispatcher
+
+        # 设置命令菜单(显示在输入框左侧)
+        logger.info("设置命令菜单")
+        updater.bot.set_my_commands(commands)
+
+        # 注册命令处理器
+        for command, callback in cmd_handlers.items():
+            dispatcher.add_handler(CommandHandler(command, callback))
+
+        # 全局消息处理器 - 处理所有文本消息，不需要先使用/start
+        dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, msg_handler))
+
+        # 添加错误处理器
+        dispatcher.add_error_handler(error_handler)
+
+        # 启动机器人
+        start_receiving_updates(updater, token, bot_name)
+        logger.info(f"{bot_name}已成功启动")
+        logger.info("用户现在可以直接发送YouTube链接而无需先使用/start命令")
+
+        # 保持运行
+        updater.idle()
+
+        return 0
+
+    except Exception as e:
+        logger.error(f"启动{bot_name}时出错: {str(e)}")
+        logger.error(traceback.format_exc())
+        return 1
@@ -6,6 +6,8 @@ YouTube音频下载 Telegram机器人
 """
 
 import os
+import asyncio
+import functools
 import logging
 import threading
 from queue import Queue
@@ -19,12 +21,12 @@ import re
 # 导入项目模块
 from audioprocess.config.settings import (
     TELEGRAM_YOUTUBE_AUDIO_DOWNLOAD_BOT_TOKEN,
-    TELEGRAM_ALLOWED_USERS,
     DOWNLOADS_DIR
 )
+from audioprocess.scripts._bot_runtime import require_auth, log_allowed_users, TELEGRAM_UPLOAD_LIMIT
 
 # 导入音频下载功能
-from audioprocess.utils.youtube_utils import download_audio_from_youtube
+from audioprocess.core.youtube_downloader_async import AsyncYouTubeDownloader
 
 # 配置日志
 logging.basicConfig(
@@ -41,23 +43,120 @@ logger = logging.getLogger(__name__)
 # 会话状态
 MAIN = 0
 
-# YouTube链接匹配模式
-YOUTUBE_PATTERN = r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
+# 允许同时排队和进行中的下载任务数，超出后直接提示用户稍后重试
+MAX_PENDING_DOWNLOADS = int(os.environ.get("YTDL_MAX_PENDING", "16"))
+_pending_downloads = threading.BoundedSemaphore(MAX_PENDING_DOWNLOADS)
+
+# 上传文件的超时时间（秒）
+UPLOAD_TIMEOUT = 600
+# 同一状态消息两次编辑之间的最小间隔（秒）
+STATUS_EDIT_INTERVAL = 2.0
+
+# YouTube链接匹配模式（模块加载时编译一次），分组1为11位视频ID
+_YT_RE = re.compile(
+    r'(?:https?://)?(?:www\.)?(?:youtube|youtu|youtube-nocookie)\.(?:com|be)/'
+    r'(?:watch\?v=|embed/|v/|.+\?v=)?([A-Za-z0-9_-]{11})',
+    re.ASCII
+)
+
+def _may_contain_youtube_link(text):
+    """廉价的子串预检，正则能匹配的域名都包含'youtu'，不含它的消息无需运行正则"""
+    return 'youtu' in text
+
+def extract_video_id(text):
+    """从文本中提取YouTube视频ID，没有YouTube链接时返回None"""
+    if not _may_contain_youtube_link(text):
+        return None
+    match = _YT_RE.search(text)
+    return match.group(1) if match else None
 
 def is_youtube_url(text):
     """检查文本是否是YouTube URL"""
-    match = re.search(YOUTUBE_PATTERN, text)
-    return bool(match)
+    return _may_contain_youtube_link(text) and _YT_RE.search(text) is not None
 
-def start(update: Update, context: CallbackContext) -> int:
-    """发送欢迎消息并显示主菜单"""
-    user_id = str(update.effective_user.id)
+@functools.lru_cache(maxsize=1)
+def _get_event_loop():
+    """获取在后台线程中运行的事件循环，首次调用时启动"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="download-loop", daemon=True)
+    thread.start()
+    return loop
+
+@functools.lru_cache(maxsize=1)
+def _get_downloader():
+    """获取共享的异步下载器"""
+    return AsyncYouTubeDownloader(output_path=DOWNLOADS_DIR)
+
+def _on_download_done(future):
+    """下载任务结束后释放排队名额，并记录未捕获的异常"""
+    _pending_downloads.release()
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("下载任务异常退出: %s", future.exception())
+
+async def _run_blocking(func, *args, **kwargs):
+    """在默认线程池中执行阻塞的Telegram API调用，避免阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+class _StatusMessage:
+    """
+    合并状态消息的编辑：间隔期内的多次更新只发送最新的一条
+    
+    所有方法都必须在后台事件循环中调用
+    """
+    
+    def __init__(self, message):
+        self._message = message
+        self._pending = None
+        self._last_sent = None
+        self._last_edit = 0.0
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+    
+    def update(self, text):
+        """登记最新状态，按间隔合并后再编辑消息"""
+        self._pending = text
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+    
+    async def finish(self, text):
+        """
+        立即把消息编辑为最终状态，丢弃尚未发送的中间状态
+        
+        返回:
+            bool: 编辑是否成功
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._pending = text
+        return await self._edit()
     
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return ConversationHandler.END
+    async def _flush_later(self):
+        loop = asyncio.get_running_loop()
+        delay = self._last_edit + STATUS_EDIT_INTERVAL - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._flush_task = None
+        await self._edit()
     
+    async def _edit(self):
+        async with self._lock:
+            text, self._pending = self._pending, None
+            if text is None or text == self._last_sent:
+                return True
+            self._last_edit = asyncio.get_running_loop().time()
+            try:
+                await _run_blocking(self._message.edit_text, text)
+            except Exception as e:
+                logger.error("更新状态消息失败: %s", e)
+                return False
+            self._last_sent = text
+            return True
+
+@require_auth(ConversationHandler.END)
+def start(update: Update, context: CallbackContext) -> int:
+    """发送欢迎消息并显示主菜单"""
     update.message.reply_text(
         f"👋 你好 {update.effective_user.first_name}!\n\n"
         "我是YouTube音频下载助手\n\n"
@@ -69,15 +168,9 @@ def start(update: Update, context: CallbackContext) -> int:
     
     return MAIN
 
+@require_auth()
 def help_command(update: Update, context: CallbackContext) -> None:
     """发送帮助消息"""
-    user_id = str(update.effective_user.id)
-    
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return
-    
     update.message.reply_text(
         "🔍 *YouTube音频下载助手使用说明*\n\n"
         "*使用方式*\n"
@@ -94,110 +187,90 @@ def help_command(update: Update, context: CallbackContext) -> None:
         parse_mode=ParseMode.MARKDOWN
     )
 
-def download_audio_in_thread(update, context, url):
-    """在后台线程中下载音频并发送到Telegram"""
+async def download_audio_async(update, url):
+    """下载音频并发送到Telegram，下载在有界线程池中执行"""
     # 发送处理中消息
-    message = update.message.reply_text("⏳ 正在处理YouTube链接...")
+    message = await _run_blocking(update.message.reply_text, "⏳ 正在处理YouTube链接...")
+    status = _StatusMessage(message)
     
     try:
-        logger.info(f"开始处理下载请求: {url}")
+        logger.info("开始处理下载请求: %s", url)
+        
+        # 下载音频文件
+        status.update("⏳ 正在从YouTube下载音频...")
+        logger.info("开始下载音频: %s", url)
+        audio_file = await _get_downloader().download(url)
         
-        # 保存原始代理设置
-        original_proxies = {}
-        for proxy_var in ['HTTP_PROXY', 'http_proxy', 'HTTPS_PROXY', 'https_proxy', 'NO_PROXY', 'no_proxy']:
-            if proxy_var in os.environ:
-                original_proxies[proxy_var] = os.environ[proxy_var]
+        if not audio_file:
+            logger.error("下载失败: %s", url)
+            await status.finish("❌ 下载失败！无法从提供的链接下载音频。")
+            return
         
-        logger.info(f"保存的代理设置: {original_proxies}")
+        logger.info("下载成功: %s", audio_file)
         
+        # 通知用户下载完成,准备发送
+        status.update("✅ 下载完成！正在发送音频文件...")
+        
+        # 发送音频文件
         try:
-            # 下载音频文件
-            message.edit_text("⏳ 正在从YouTube下载音频...")
-            logger.info(f"开始下载音频: {url}")
-            audio_file = download_audio_from_youtube(url, output_path=DOWNLOADS_DIR)
-            
-            if not audio_file:
-                logger.error(f"下载失败: {url}")
-                message.edit_text("❌ 下载失败！无法从提供的链接下载音频。")
-                return
-            
-            logger.info(f"下载成功: {audio_file}")
-            
-            # 通知用户下载完成,准备发送
-            message.edit_text("✅ 下载完成！正在发送音频文件...")
-            
-            # 禁用代理发送文件
-            logger.info("禁用代理以发送文件")
-            os.environ['NO_PROXY'] = '*'
-            
-            # 发送音频文件
-            try:
-                logger.info(f"开始发送音频文件: {audio_file}")
-                with open(audio_file, 'rb') as audio:
-                    update.message.reply_document(
-                        document=audio,
-                        filename=os.path.basename(audio_file),
-                        caption=f"🎵 从YouTube下载的音频文件"
-                    )
-                logger.info("音频文件发送成功")
-            except Exception as send_error:
-                logger.error(f"发送音频文件失败: {str(send_error)}")
-                update.message.reply_text(f"❌ 发送文件失败: {str(send_error)}")
-            
-            # 通知下载和发送完成
-            try:
-                message.edit_text("✅ 音频已发送！")
-            except Exception as edit_error:
-                logger.error(f"更新状态消息失败: {str(edit_error)}")
-            
-        finally:
-            # 恢复原始代理设置
-            logger.info("恢复原始代理设置")
-            for proxy_var in ['NO_PROXY', 'no_proxy']:
-                if proxy_var in os.environ:
-                    del os.environ[proxy_var]
-            
-            for proxy_var, value in original_proxies.items():
-                os.environ[proxy_var] = value
+            logger.info("开始发送音频文件: %s", audio_file)
+            await _run_blocking(send_audio_file, update, audio_file)
+            logger.info("音频文件发送成功")
+        except Exception as send_error:
+            logger.error("发送音频文件失败: %s", send_error)
+            await _run_blocking(update.message.reply_text, f"❌ 发送文件失败: {str(send_error)}")
+        
+        # 通知下载和发送完成
+        await status.finish("✅ 音频已发送！")
         
     except Exception as e:
-        logger.error(f"处理YouTube链接时出错: {str(e)}", exc_info=True)
-        try:
-            message.edit_text(f"❌ 处理过程中出错: {str(e)}")
-        except:
-            update.message.reply_text(f"❌ 处理过程中出错: {str(e)}")
+        logger.error("处理YouTube链接时出错: %s", e, exc_info=True)
+        if not await status.finish(f"❌ 处理过程中出错: {str(e)}"):
+            await _run_blocking(update.message.reply_text, f"❌ 处理过程中出错: {str(e)}")
+
+def send_audio_file(update, audio_file):
+    """把下载好的音频文件作为文档发送给用户"""
+    # 超过上传限制的文件会被Telegram拒绝，提前失败以免把整个文件读入内存
+    file_size = os.stat(audio_file).st_size
+    if file_size > TELEGRAM_UPLOAD_LIMIT:
+        raise ValueError(f"文件大小 {file_size / 1024 / 1024:.1f}MB 超过Telegram的50MB上传限制")
+    
+    with open(audio_file, 'rb') as audio:
+        update.message.reply_document(
+            document=audio,
+            filename=os.path.basename(audio_file),
+            caption=f"🎵 从YouTube下载的音频文件",
+            timeout=UPLOAD_TIMEOUT
+        )
 
+@require_auth(MAIN)
 def handle_message(update: Update, context: CallbackContext) -> int:
     """处理用户消息"""
-    user_id = str(update.effective_user.id)
     text = update.message.text
     
-    logger.info(f"收到来自用户 {user_id} 的消息: {text}")
-    
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        logger.warning(f"用户 {user_id} 尝试访问，但不在允许列表中")
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return MAIN
+    logger.info("收到来自用户 %s 的消息: %s", update.effective_user.id, text)
     
     # 检查是否为YouTube链接
-    if is_youtube_url(text):
-        logger.info(f"检测到有效的YouTube链接: {text}")
+    video_id = extract_video_id(text)
+    if video_id:
+        logger.info("检测到有效的YouTube链接: %s（视频ID: %s）", text, video_id)
+        # 排队任务过多时直接拒绝，避免无限堆积
+        if not _pending_downloads.acquire(blocking=False):
+            logger.warning("下载任务已满，拒绝新任务: %s", text)
+            update.message.reply_text("⏳ 当前下载任务较多，请稍后再发送链接。")
+            return MAIN
+        
         try:
-            # 启动后台线程处理下载
-            logger.info(f"创建下载线程处理链接: {text}")
-            thread = threading.Thread(
-                target=download_audio_in_thread,
-                args=(update, context, text)
-            )
-            thread.daemon = True
-            thread.start()
-            logger.info(f"下载线程已启动: {thread.name}")
+            # 把下载任务提交到后台事件循环，并发数由下载线程池限制
+            logger.info("提交下载任务: %s", text)
+            future = asyncio.run_coroutine_threadsafe(download_audio_async(update, text), _get_event_loop())
+            future.add_done_callback(_on_download_done)
         except Exception as e:
-            logger.error(f"创建下载线程时出错: {str(e)}", exc_info=True)
+            _pending_downloads.release()
+            logger.error("提交下载任务时出错: %s", e, exc_info=True)
             update.message.reply_text(f"❌ 处理链接时出错: {str(e)}")
     else:
-        logger.warning(f"收到无效链接: {text}")
+        logger.warning("收到无效链接: %s", text)
         update.message.reply_text(
             "⚠️ 请发送有效的YouTube链接。\n\n"
             "示例:\n"
@@ -214,7 +287,7 @@ def cancel(update: Update, context: CallbackContext) -> int:
 
 def error_handler(update, context):
     """处理错误"""
-    logger.error(f"更新 {update} 导致错误 {context.error}")
+    logger.error("更新 %s 导致错误 %s", update, context.error)
     try:
         if update and update.effective_message:
             update.effective_message.reply_text("发生错误，请稍后重试。")
@@ -229,9 +302,9 @@ def main():
         print("错误: 请在环境变量或配置文件中设置TELEGRAM_YOUTUBE_AUDIO_DOWNLOAD_BOT_TOKEN")
         return 1
     
-    logger.info(f"音频下载机器人启动中，使用Token: {TELEGRAM_YOUTUBE_AUDIO_DOWNLOAD_BOT_TOKEN[:10]}...{TELEGRAM_YOUTUBE_AUDIO_DOWNLOAD_BOT_TOKEN[-5:]}")
-    logger.info(f"允许的用户: {TELEGRAM_ALLOWED_USERS}")
-    logger.info(f"下载目录: {DOWNLOADS_DIR}")
+    logger.info("音频下载机器人启动中，使用Token: %s...%s", TELEGRAM_YOUTUBE_AUDIO_DOWNLOAD_BOT_TOKEN[:10], TELEGRAM_YOUTUBE_AUDIO_DOWNLOAD_BOT_TOKEN[-5:])
+    log_allowed_users()
+    logger.info("下载目录: %s", DOWNLOADS_DIR)
     
     try:
         # 创建Updater和Dispatcher
@@ -281,7 +354,7 @@ def main():
         return updater  # 返回updater对象以便主程序控制
     
     except Exception as e:
-        logger.error(f"启动机器人时出错: {str(e)}", exc_info=True)
+        logger.error("启动机器人时出错: %s", e, exc_info=True)
         return None
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ Telegram机器人设置脚本
 """
 
 import os
+import re
 import sys
 import subprocess
 import argparse
@@ -81,13 +82,13 @@ def configure_telegram_bot():
                 update_config_value("TELEGRAM_ALLOWED_USERS", new_users)
                 print("用户ID列表已更新")
     else:
-        new_users = input("请输入允许使用机器人的用户ID (用逗号分隔，留空表示允许所有用户): ").strip()
+        new_users = input("请输入允许使用机器人的用户ID (用逗号分隔，留空表示拒绝所有用户): ").strip()
         if new_users:
             # 更新配置文件中的用户ID列表
             update_config_value("TELEGRAM_ALLOWED_USERS", new_users)
             print("用户ID列表已设置")
         else:
-            print("警告: 未限制用户ID，所有用户都能使用机器人")
+            print("警告: 未设置允许的用户ID，所有用户都将被拒绝")
 
 def update_config_value(key, value):
     """更新配置文件中的值"""
@@ -101,36 +102,31 @@ def update_config_value(key, value):
     try:
         # 读取当前配置
         with open(config_file, "r", encoding="utf-8") as f:
-            lines = f.readlines()
+            text = f.read()
         
-        # 找到并更新对应的行
-        updated = False
-        for i, line in enumerate(lines):
-            if line.strip().startswith(f"{key} = "):
-                if key == "TELEGRAM_ALLOWED_USERS":
-                    # 对于用户ID列表，需要特殊处理分割逻辑
-                    lines[i] = f'{key} = os.environ.get("{key}", "").split(",")\n'
-                    # 同时也要更新环境变量
-                    os.environ[key] = value
-                else:
-                    # 对于普通字符串值
-                    lines[i] = f'{key} = os.environ.get("{key}", "{value}")\n'
-                    # 同时也要更新环境变量
-                    os.environ[key] = value
-                updated = True
-                break
+        if key == "TELEGRAM_ALLOWED_USERS":
+            # 对于用户ID列表，需要特殊处理分割逻辑
+            new_line = f'{key} = os.environ.get("{key}", "").split(",")'
+        else:
+            # 对于普通字符串值
+            new_line = f'{key} = os.environ.get("{key}", "{value}")'
+        
+        # 一次正则替换找到并更新对应的行
+        pattern = re.compile(rf'^[ \t]*{re.escape(key)} = .*$', re.M)
+        text, n = pattern.subn(lambda m: new_line, text, count=1)
         
-        if not updated:
+        if n == 0:
             # 如果没有找到对应的行，则在文件末尾添加
-            if key == "TELEGRAM_ALLOWED_USERS":
-                lines.append(f'{key} = os.environ.get("{key}", "").split(",")\n')
-            else:
-                lines.append(f'{key} = os.environ.get("{key}", "{value}")\n')
-            os.environ[key] = value
+            if text and not text.endswith("\n"):
+                text += "\n"
+            text += new_line + "\n"
+        
+        # 同时也要更新环境变量
+        os.environ[key] = value
         
         # 写回配置文件
         with open(config_file, "w", encoding="utf-8") as f:
-            f.writelines(lines)
+            f.write(text)
         
         return True
     except Exception as e:
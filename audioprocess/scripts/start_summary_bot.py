@@ -6,51 +6,35 @@
 """
 
 import os
+import re
 import sys
 import logging
-import traceback
-import threading
+from functools import lru_cache
 from telegram import Update, ParseMode, ReplyKeyboardMarkup, KeyboardButton, BotCommand
-from telegram.ext import (
-    Updater, CommandHandler, MessageHandler, Filters,
-    CallbackContext
-)
-
-# 将项目根目录添加到路径
-current_dir = os.path.dirname(os.path.abspath(__file__))
-project_root = os.path.abspath(os.path.join(current_dir, "../.."))
-if project_root not in sys.path:
-    sys.path.insert(0, project_root)
+from telegram.ext import CallbackContext
 
 from audioprocess.utils.youtube_utils import is_youtube_url, extract_youtube_subtitles
-from audioprocess.utils.proxy_manager import disable_proxies, restore_proxies
+from audioprocess.scripts._bot_runtime import setup_logging, run_bot, safe_reply, require_auth, log_allowed_users
+from audioprocess.utils.proxy_manager import acquire_no_proxy, release_no_proxy
 from audioprocess.main import process_youtube_video
 from audioprocess.config.settings import (
-    TELEGRAM_BOT_TOKEN, TELEGRAM_ALLOWED_USERS, 
+    TELEGRAM_BOT_TOKEN,
     TRANSCRIPTION_RESULTS_DIR, TEMP_SUBTITLES_DIR
 )
 
 # 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('summary_bot.log')
-    ]
-)
+setup_logging('summary_bot.log')
 logger = logging.getLogger(__name__)
 
+# 消息中YouTube链接的匹配模式，模块加载时编译一次
+_YOUTUBE_RE = re.compile(r'(?:https?://)?(?:(?:www\.)?youtube\.com/watch\?v=|youtu\.be/)(?P<vid>[A-Za-z0-9_-]{11})')
+
+# 同一链接会在收到消息和下载前各校验一次，用户也常重复发送，缓存校验结果
+_is_youtube_url = lru_cache(maxsize=1024)(is_youtube_url)
+
+@require_auth()
 def start(update: Update, context: CallbackContext):
     """处理/start命令"""
-    user_id = str(update.effective_user.id)
-    
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return
-    
     # 创建按钮
     keyboard = [
         [KeyboardButton("字幕摘要")]
@@ -78,8 +62,7 @@ def help_command(update: Update, context: CallbackContext) -> None:
 
 def test_command(update: Update, context: CallbackContext) -> None:
     """处理/test命令，用于测试机器人是否响应"""
-    user_id = str(update.effective_user.id)
-    logger.info(f"收到来自用户 {user_id} 的测试命令")
+    logger.info("收到来自用户 %s 的测试命令", update.effective_user.id)
     
     # 发送测试响应
     update.message.reply_text(
@@ -97,27 +80,12 @@ def cancel(update: Update, context: CallbackContext):
     if 'youtube_urls' in context.user_data:
         del context.user_data['youtube_urls']
 
-def error_handler(update, context):
-    """处理错误"""
-    logger.error(f"更新 {update} 导致错误 {context.error}")
-    try:
-        if update and update.effective_message:
-            update.effective_message.reply_text("发生错误，请稍后重试。")
-    except:
-        pass
-
+@require_auth()
 def handle_message(update: Update, context: CallbackContext):
     """处理用户消息"""
-    user_id = str(update.effective_user.id)
     text = update.message.text
     
-    logger.info(f"收到来自用户 {user_id} 的消息: {text}")
-    
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        logger.warning(f"用户 {user_id} 尝试访问，但不在允许列表中")
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return
+    logger.info("收到来自用户 %s 的消息: %s", update.effective_user.id, text)
     
     # 处理按钮点击
     if text == "字幕摘要":
@@ -126,44 +94,37 @@ def handle_message(update: Update, context: CallbackContext):
         )
         return
     
+    # 所有youtube.com和youtu.be链接都包含"youtu"，不含该子串的消息跳过正则匹配
+    maybe_youtube = "youtu" in text
+    
     # 从文本中提取可能的YouTube链接
-    import re
-    youtube_pattern = r'(https?://)?((www\.)?youtube\.com/watch\?v=|youtu\.be/)([a-zA-Z0-9_-]{11})'
-    matches = re.findall(youtube_pattern, text)
+    # 统一规范化为标准的watch链接
+    extracted_urls = [f"https://www.youtube.com/watch?v={m['vid']}" for m in _YOUTUBE_RE.finditer(text)] if maybe_youtube else []
     
-    if matches:
+    if extracted_urls:
         # 找到一个或多个YouTube链接
-        extracted_urls = []
-        for match in matches:
-            # 重建完整URL
-            full_url = f"https://www.youtube.com/watch?v={match[3]}" if "youtube.com" in match[1] else f"https://youtu.be/{match[3]}"
-            extracted_urls.append(full_url)
-        
-        logger.info(f"从消息中提取到 {len(extracted_urls)} 个YouTube链接")
+        logger.info("从消息中提取到 %d 个YouTube链接", len(extracted_urls))
         
         if len(extracted_urls) == 1:
             # 只有一个链接，直接处理
             youtube_url = extracted_urls[0]
-            logger.info(f"处理提取的链接: {youtube_url}")
+            logger.info("处理提取的链接: %s", youtube_url)
             try:
                 update.message.reply_text(f"⏳ 正在处理YouTube链接: {youtube_url}")
-                thread = threading.Thread(
-                    target=process_youtube_in_thread,
-                    args=(update, context, youtube_url)
-                )
-                thread.daemon = True
-                thread.start()
+                # 交给Dispatcher的工作线程池执行，未捕获的异常会转交错误处理器
+                context.dispatcher.run_async(process_youtube_in_thread, update, context, youtube_url, update=update)
                 return
             except Exception as e:
-                logger.error(f"创建处理线程时出错: {str(e)}", exc_info=True)
+                logger.error("创建处理线程时出错: %s", e, exc_info=True)
                 update.message.reply_text(f"❌ 处理链接时出错: {str(e)}")
                 return
         else:
             # 多个链接，让用户选择
-            response = "我发现多个YouTube链接，请选择要处理的链接:\n\n"
-            for i, url in enumerate(extracted_urls, 1):
-                response += f"{i}. {url}\n"
-            response += "\n请回复链接编号(1-{})来选择要处理的视频。".format(len(extracted_urls))
+            lines = ["我发现多个YouTube链接，请选择要处理的链接:", ""]
+            lines.extend(f"{i}. {url}" for i, url in enumerate(extracted_urls, 1))
+            lines.append("")
+            lines.append(f"请回复链接编号(1-{len(extracted_urls)})来选择要处理的视频。")
+            response = "\n".join(lines)
             
             # 保存链接列表到用户数据中
             context.user_data['youtube_urls'] = extracted_urls
@@ -172,25 +133,24 @@ def handle_message(update: Update, context: CallbackContext):
             return
     
     # 检查是否为YouTube链接
-    logger.info(f"正在检查链接是否为YouTube URL: {text}")
-    youtube_url_check = is_youtube_url(text)
-    logger.info(f"链接检查结果: {'是YouTube链接' if youtube_url_check else '不是YouTube链接'}")
+    if maybe_youtube:
+        logger.info("正在检查链接是否为YouTube URL: %s", text)
+        youtube_url_check = _is_youtube_url(text)
+        logger.info("链接检查结果: %s", '是YouTube链接' if youtube_url_check else '不是YouTube链接')
+    else:
+        youtube_url_check = False
     
     if youtube_url_check:
-        logger.info(f"检测到有效的YouTube链接: {text}")
+        logger.info("检测到有效的YouTube链接: %s", text)
         try:
             # 启动线程处理YouTube视频
-            logger.info(f"创建线程处理链接: {text}")
+            logger.info("创建线程处理链接: %s", text)
             update.message.reply_text("⏳ 收到链接，准备处理...", quote=True)
-            thread = threading.Thread(
-                target=process_youtube_in_thread,
-                args=(update, context, text)
-            )
-            thread.daemon = True
-            thread.start()
-            logger.info(f"处理线程已启动: {thread.name}")
+            # 交给Dispatcher的工作线程池执行，未捕获的异常会转交错误处理器
+            context.dispatcher.run_async(process_youtube_in_thread, update, context, text, update=update)
+            logger.info("处理任务已提交: %s", text)
         except Exception as e:
-            logger.error(f"创建处理线程时出错: {str(e)}", exc_info=True)
+            logger.error("创建处理线程时出错: %s", e, exc_info=True)
             update.message.reply_text(f"❌ 处理链接时出错: {str(e)}")
     else:
         # 检查是否是数字回复（选择之前提取的链接）
@@ -200,25 +160,21 @@ def handle_message(update: Update, context: CallbackContext):
             
             if 1 <= choice <= len(urls):
                 selected_url = urls[choice-1]
-                logger.info(f"用户选择了链接 {choice}: {selected_url}")
+                logger.info("用户选择了链接 %d: %s", choice, selected_url)
                 
                 try:
                     update.message.reply_text(f"⏳ 正在处理所选YouTube链接: {selected_url}")
-                    thread = threading.Thread(
-                        target=process_youtube_in_thread,
-                        args=(update, context, selected_url)
-                    )
-                    thread.daemon = True
-                    thread.start()
+                    # 交给Dispatcher的工作线程池执行，未捕获的异常会转交错误处理器
+                    context.dispatcher.run_async(process_youtube_in_thread, update, context, selected_url, update=update)
                 except Exception as e:
-                    logger.error(f"创建处理线程时出错: {str(e)}", exc_info=True)
+                    logger.error("创建处理线程时出错: %s", e, exc_info=True)
                     update.message.reply_text(f"❌ 处理链接时出错: {str(e)}")
             else:
                 update.message.reply_text(f"❌ 无效的选择。请选择1到{len(urls)}之间的数字。")
             
             return
         
-        logger.warning(f"收到无效链接: {text}")
+        logger.warning("收到无效链接: %s", text)
         update.message.reply_text(
             "⚠️ 请发送有效的YouTube链接。\n\n"
             "示例:\n"
@@ -232,8 +188,8 @@ def process_youtube_in_thread(update: Update, context: CallbackContext, youtube_
         # 发送处理中消息
         message = update.message.reply_text("⏳ 正在处理YouTube视频，请稍候...")
         
-        # 禁用代理，处理完成后恢复
-        original_proxies = disable_proxies()
+        # 禁用代理（并发任务共享，环境变量只切换一次），处理完成后恢复
+        acquire_no_proxy()
         
         try:
             # 处理YouTube视频，获取字幕和摘要
@@ -264,18 +220,15 @@ def process_youtube_in_thread(update: Update, context: CallbackContext, youtube_
                 message.edit_text(f"❌ 处理视频时出错: {error_msg}")
                 
         except Exception as e:
-            logger.error(f"处理YouTube视频时出错: {str(e)}", exc_info=True)
+            logger.error("处理YouTube视频时出错: %s", e, exc_info=True)
             message.edit_text(f"❌ 处理视频时出错: {str(e)}")
         finally:
             # 恢复原来的代理设置
-            restore_proxies(original_proxies)
+            release_no_proxy()
             
     except Exception as e:
-        logger.error(f"YouTube处理线程中出错: {str(e)}", exc_info=True)
-        try:
-            update.message.reply_text(f"❌ 处理过程中出错: {str(e)}")
-        except:
-            pass
+        logger.error("YouTube处理线程中出错: %s", e, exc_info=True)
+        safe_reply(update, f"❌ 处理过程中出错: {str(e)}")
 
 def main():
     """启动机器人"""
@@ -290,51 +243,21 @@ def main():
     os.makedirs(TEMP_SUBTITLES_DIR, exist_ok=True)
     
     logger.info(f"字幕摘要机器人启动中，使用Token: {TELEGRAM_BOT_TOKEN[:8]}...{TELEGRAM_BOT_TOKEN[-5:]}")
-    logger.info(f"允许的用户ID列表: {TELEGRAM_ALLOWED_USERS}")
+    log_allowed_users()
     
-    try:
-        # 创建Updater和Dispatcher
-        updater = Updater(TELEGRAM_BOT_TOKEN, use_context=True)
-        dispatcher = updater.dispatcher
-        
-        # 设置命令菜单(显示在输入框左侧)
-        commands = [
-            BotCommand("start", "启动机器人/显示菜单"),
-            BotCommand("help", "显示帮助信息"),
-            BotCommand("test", "测试机器人是否正常响应")
-        ]
-        updater.bot.set_my_commands(commands)
-        
-        # 注册命令处理器
-        dispatcher.add_handler(CommandHandler("start", start))
-        dispatcher.add_handler(CommandHandler("help", help_command))
-        dispatcher.add_handler(CommandHandler("test", test_command))
-        dispatcher.add_handler(CommandHandler("cancel", cancel))
-        
-        # 全局消息处理器 - 处理所有文本消息，不需要先使用/start
-        dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_message))
-        
-        # 添加错误处理器
-        dispatcher.add_error_handler(error_handler)
-        
-        # 先删除webhook以确保轮询模式可以工作
-        updater.bot.delete_webhook()
-        
-        # 启动机器人
-        logger.info("启动字幕摘要机器人轮询...")
-        updater.start_polling(drop_pending_updates=True)
-        logger.info("字幕摘要机器人已成功启动")
-        logger.info("用户现在可以直接发送YouTube链接而无需先使用/start命令")
-        
-        # 保持运行
-        updater.idle()
-        
-        return 0
-        
-    except Exception as e:
-        logger.error(f"启动字幕摘要机器人时出错: {str(e)}")
-        logger.error(traceback.format_exc())
-        return 1
+    # 设置命令菜单(显示在输入框左侧)
+    commands = [
+        BotCommand("start", "启动机器人/显示菜单"),
+        BotCommand("help", "显示帮助信息"),
+        BotCommand("test", "测试机器人是否正常响应")
+    ]
+    cmd_handlers = {
+        "start": start,
+        "help": help_command,
+        "test": test_command,
+        "cancel": cancel,
+    }
+    return run_bot(TELEGRAM_BOT_TOKEN, "字幕摘要机器人", commands, cmd_handlers, handle_message)
 
 if __name__ == "__main__":
     sys.exit(main()) 
\ No newline at end of file
@@ -10,85 +10,75 @@ import re
 import sys
 import time
 import logging
-import asyncio
 import threading
-from queue import Queue, Empty
-from telegram import Update, ParseMode, ReplyKeyboardMarkup, KeyboardButton, BotCommand, Bot
+from collections import OrderedDict
+from telegram import Update, ParseMode, ReplyKeyboardMarkup, KeyboardButton, BotCommand, Bot, InputFile
 from telegram.ext import (
     Updater, CommandHandler, MessageHandler, Filters,
     CallbackContext, ConversationHandler
 )
+from telegram.utils.helpers import escape_markdown
 import traceback
 
 # 将项目根目录添加到路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from audioprocess.utils.logger import setup_logger, get_logger
+from audioprocess.utils.logger import get_logger
+from audioprocess.utils.proxy_manager import acquire_no_proxy, release_no_proxy
+from audioprocess.scripts._bot_runtime import (
+    setup_logging, start_receiving_updates, require_auth, log_allowed_users, TELEGRAM_UPLOAD_LIMIT
+)
 from audioprocess.config.settings import (
-    TELEGRAM_BOT_TOKEN, TELEGRAM_ALLOWED_USERS, 
-    DASHSCOPE_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL,
+    TELEGRAM_BOT_TOKEN,
     TELEGRAM_YOUTUBE_AUDIO_DOWNLOAD_BOT_TOKEN,
     TRANSCRIPTION_RESULTS_DIR, TEMP_SUBTITLES_DIR, DOWNLOADS_DIR
 )
 from audioprocess.main import process_youtube_video
-from audioprocess.core.youtube_downloader import download_audio_from_youtube
-from audioprocess.core.summarization import summarize_text
 
 # 设置日志
 logger = get_logger(__name__)
 
-# 创建一个队列用于存储日志消息
-log_queue = Queue()
+# Dispatcher工作线程数，同时也是并发处理视频任务的上限
+BOT_WORKERS = int(os.environ.get("TELEGRAM_BOT_WORKERS", "4"))
+
+# 结果文件的发送优先级: (结果字段, 文件说明, 发送失败时的保存提示)
+FILE_PRIORITY = (
+    ('summary_file', "📋 完整转录和摘要结果文件", "结果已保存到"),
+    ('subtitle_file', "📋 字幕文件", "字幕已保存到"),
+    ('transcription_file', "📋 转录结果文件", "转录结果已保存到"),
+)
+
+# 最近处理成功的结果缓存 {视频ID: result}，按最近使用顺序淘汰，重复发送同一视频时直接返回结果
+RESULT_CACHE_SIZE = 128
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+# Telegram单条文本消息的最大长度
+MAX_MESSAGE_LENGTH = 4096
 
 # 会话状态
 MAIN = 0
 YOUTUBE = 1  # 字幕摘要模式
 SUMMARY = 2  # 摘要模式
 
-# 自定义日志处理器，将日志添加到队列
-class QueueHandler(logging.Handler):
-    def __init__(self, log_queue):
-        super().__init__()
-        self.log_queue = log_queue
+# YouTube URL正则表达式，模块加载时编译一次
+YOUTUBE_PAT = re.compile(r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})')
 
-    def emit(self, record):
-        try:
-            msg = self.format(record)
-            self.log_queue.put(msg)
-        except Exception:
-            self.handleError(record)
-
-# 添加队列处理器到根日志记录器
-def setup_queue_logger():
-    root_logger = logging.getLogger()
-    queue_handler = QueueHandler(log_queue)
-    queue_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', '%Y-%m-%d %H:%M:%S'))
-    queue_handler.setLevel(logging.INFO)
-    root_logger.addHandler(queue_handler)
+# 主菜单键盘内容固定，模块加载时创建一次
+_MAIN_KEYBOARD = ReplyKeyboardMarkup([[KeyboardButton("📝 字幕摘要")]], resize_keyboard=True)
 
-# YouTube URL正则表达式
-YOUTUBE_REGEX = r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
-
-# 创建主菜单键盘
 def get_main_keyboard():
-    """创建主菜单键盘"""
-    keyboard = [
-        [KeyboardButton("📝 字幕摘要")],
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    """返回主菜单键盘"""
+    return _MAIN_KEYBOARD
 
 # 处理/start命令
+@require_auth(ConversationHandler.END)
 def start(update: Update, context: CallbackContext) -> int:
     """发送欢迎消息并显示主菜单"""
-    user_id = str(update.effective_user.id)
-    
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return ConversationHandler.END
-    
+    # 用户名可能包含 _ * ` [ 等Markdown字符，转义后才能安全地按Markdown发送
+    first_name = escape_markdown(update.effective_user.first_name or "")
     update.message.reply_text(
-        f"👋 你好 {update.effective_user.first_name}!\n\n"
+        f"👋 你好 {first_name}!\n\n"
         "我是YouTube字幕摘要助手，可以提取视频字幕并生成摘要\n\n"
         "使用方式：\n"
         "• 点击聊天框左侧的菜单按钮(/) 选择命令\n"
@@ -102,15 +92,9 @@ def start(update: Update, context: CallbackContext) -> int:
     return MAIN
 
 # 处理/help命令
+@require_auth()
 def help_command(update: Update, context: CallbackContext) -> None:
     """发送帮助消息"""
-    user_id = str(update.effective_user.id)
-    
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return
-    
     update.message.reply_text(
         "🔍 *YouTube字幕摘要助手使用说明*\n\n"
         "*使用方式*\n"
@@ -128,15 +112,9 @@ def help_command(update: Update, context: CallbackContext) -> None:
     )
 
 # 处理/cancel命令
+@require_auth(ConversationHandler.END)
 def cancel(update: Update, context: CallbackContext) -> int:
     """取消当前操作并返回主菜单"""
-    user_id = str(update.effective_user.id)
-    
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return ConversationHandler.END
-    
     # 清除会话数据
     context.user_data.clear()
     
@@ -147,41 +125,28 @@ def cancel(update: Update, context: CallbackContext) -> int:
     
     return MAIN
 
-# 检查消息是否包含YouTube链接
-def is_youtube_link(text):
-    """检查文本是否包含YouTube链接"""
-    return bool(re.search(YOUTUBE_REGEX, text))
-
 # 从文本中提取YouTube链接
 def extract_youtube_link(text):
     """从文本中提取YouTube链接"""
-    match = re.search(YOUTUBE_REGEX, text)
-    if match:
-        video_id = match.group(6)
-        return f"https://www.youtube.com/watch?v={video_id}"
-    return None
+    match = YOUTUBE_PAT.search(text)
+    if not match:
+        return None
+    # 已是标准格式的链接直接截取原文，只有短链接、embed等形式才重新拼接
+    if match.group(1, 2, 3, 4, 5) == ("https://", "www.", "youtube", "com", "watch?v="):
+        return match.group(0)
+    return f"https://www.youtube.com/watch?v={match.group(6)}"
 
 # 处理用户消息
+@require_auth(MAIN)
 def handle_message(update: Update, context: CallbackContext) -> int:
     """处理用户消息，主要处理YouTube链接"""
-    user_id = str(update.effective_user.id)
-    
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return MAIN
-    
     text = update.message.text
     
-    # 检查是否为YouTube链接
-    if is_youtube_link(text):
-        # 启动后台线程处理YouTube视频
-        thread = threading.Thread(
-            target=process_youtube_in_thread,
-            args=(update, context, text)
-        )
-        thread.daemon = True
-        thread.start()
+    # 只匹配一次，同时完成检查和链接提取
+    youtube_url = extract_youtube_link(text)
+    if youtube_url:
+        # 交给Dispatcher的工作线程池处理YouTube视频，未捕获的异常会转交错误处理器
+        context.dispatcher.run_async(process_youtube_in_thread, update, context, youtube_url, update=update)
     else:
         update.message.reply_text(
             "⚠️ 请发送有效的YouTube链接。\n\n"
@@ -193,28 +158,60 @@ def handle_message(update: Update, context: CallbackContext) -> int:
     return MAIN
 
 # 处理视频的线程函数
+def _get_cached_result(video_id):
+    """
+    获取视频的缓存结果，结果文件已被删除时丢弃该缓存
+    
+    参数:
+        video_id: YouTube视频ID
+    
+    返回:
+        缓存的result字典，没有可用缓存时返回None
+    """
+    with _result_cache_lock:
+        result = _result_cache.get(video_id)
+        if result is None:
+            return None
+        if not all(os.path.exists(result[key]) for key, _, _ in FILE_PRIORITY if result.get(key)):
+            del _result_cache[video_id]
+            return None
+        _result_cache.move_to_end(video_id)
+        return result
+
+def _cache_result(video_id, result):
+    """缓存处理成功的结果，超过容量时淘汰最久未使用的条目"""
+    with _result_cache_lock:
+        _result_cache[video_id] = result
+        _result_cache.move_to_end(video_id)
+        if len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+
 def process_youtube_in_thread(update, context, text):
     """在单独的线程中处理YouTube视频"""
+    # 同一视频最近已处理过且结果文件仍在时，直接发送缓存的结果
+    video_id = YOUTUBE_PAT.search(text).group(6)
+    cached = _get_cached_result(video_id)
+    if cached is not None:
+        logger.info(f"视频 {video_id} 命中结果缓存，直接发送结果")
+        send_final_result(update, context, cached)
+        return
+    
     try:
-        # 设置队列日志处理器
-        setup_queue_logger()
-        
-        # 处理YouTube视频前禁用所有代理，只在函数内部会使用代理
-        original_proxies = disable_proxies()
+        # 处理YouTube视频前禁用代理（并发任务共享，环境变量只切换一次）
+        acquire_no_proxy()
         
         try:
             # 处理YouTube视频
             logger.info(f"开始处理YouTube链接: {text}")
             result = process_youtube_video(text, force_audio=False, skip_summary=False)
-            
-            # 等待一会，确保最后的日志都被处理
-            time.sleep(1)
+            if result.get('success'):
+                _cache_result(video_id, result)
             
             # 发送最终结果
             send_final_result(update, context, result)
         finally:
-            # 恢复原始代理设置
-            restore_proxies(original_proxies)
+            # 最后一个任务结束时恢复原始代理设置
+            release_no_proxy()
         
     except Exception as e:
         error_message = f"处理视频时出错: {str(e)}"
@@ -229,14 +226,17 @@ def process_youtube_in_thread(update, context, text):
 # 发送最终处理结果，修改为发送文件和摘要内容
 def send_final_result(update, context, result):
     """发送处理完成的结果消息"""
-    # 确保禁用代理，避免发送文件时出错
-    original_proxies = disable_proxies()
+    # 只取一次message属性，后续所有回复都复用
+    message = update.message
+    
+    # 确保禁用代理，避免发送文件时出错；已在任务内禁用时只增加引用计数
+    acquire_no_proxy()
     
     try:
         if not result['success']:
             error_message = result.get('error', '未知错误')
             try:
-                update.message.reply_text(
+                message.reply_text(
                     f"❌ 处理失败: {error_message}"
                 )
             except Exception as e:
@@ -252,123 +252,73 @@ def send_final_result(update, context, result):
         elif 'audio_file' in result:
             result_text += "🔊 已下载并转录音频\n\n"
         
-        # 发送结果状态消息
-        try:
-            update.message.reply_text(
-                result_text + "请稍候，正在发送摘要和结果文件..."
-            )
-        except Exception as e:
-            logger.error(f"发送结果状态消息出错: {str(e)}")
-        
-        # 发送摘要内容作为单独消息
         if 'summary' in result:
             summary_text = f"📝 摘要:\n\n{result['summary']}"
-            try:
-                update.message.reply_text(
-                    summary_text
-                )
-            except Exception as e:
-                logger.error(f"发送摘要消息出错: {str(e)}")
         elif 'summary_error' in result:
-            try:
-                update.message.reply_text(
-                    f"⚠️ 摘要生成失败: {result['summary_error']}"
-                )
-            except Exception as e:
-                logger.error(f"发送摘要错误消息出错: {str(e)}")
+            summary_text = f"⚠️ 摘要生成失败: {result['summary_error']}"
+        else:
+            summary_text = ""
         
-        # 发送结果文件
-        if 'summary_file' in result and result['summary_file']:
-            file_path = result['summary_file']
-            try:
-                with open(file_path, 'rb') as file:
-                    update.message.reply_document(
-                        document=file,
-                        filename=os.path.basename(file_path),
-                        caption="📋 完整转录和摘要结果文件"
-                    )
-            except Exception as e:
-                logger.error(f"发送摘要文件出错: {str(e)}")
-                # 如果文件发送失败，至少发送文件路径
-                try:
-                    update.message.reply_text(
-                        f"📋 无法发送文件，结果已保存到: {file_path}"
-                    )
-                except:
-                    pass
-        elif 'subtitle_file' in result and result['subtitle_file']:
-            file_path = result['subtitle_file']
-            try:
-                with open(file_path, 'rb') as file:
-                    update.message.reply_document(
-                        document=file,
-                        filename=os.path.basename(file_path),
-                        caption="📋 字幕文件"
-                    )
-            except Exception as e:
-                logger.error(f"发送字幕文件出错: {str(e)}")
-                # 如果文件发送失败，至少发送文件路径
-                try:
-                    update.message.reply_text(
-                        f"📋 无法发送文件，字幕已保存到: {file_path}"
-                    )
-                except:
-                    pass
-        elif 'transcription_file' in result and result['transcription_file']:
-            file_path = result['transcription_file']
+        # 状态和摘要合并为一条消息发送，只有超过单条消息长度上限时才分开发送
+        if len(result_text) + len(summary_text) <= MAX_MESSAGE_LENGTH:
+            texts = [result_text + (summary_text or "正在发送结果文件...")]
+        else:
+            texts = [result_text + "请稍候，正在发送摘要和结果文件...", summary_text]
+        for text in texts:
             try:
-                with open(file_path, 'rb') as file:
-                    update.message.reply_document(
-                        document=file,
-                        filename=os.path.basename(file_path),
-                        caption="📋 转录结果文件"
-                    )
+                message.reply_text(text)
             except Exception as e:
-                logger.error(f"发送转录文件出错: {str(e)}")
-                # 如果文件发送失败，至少发送文件路径
-                try:
-                    update.message.reply_text(
-                        f"📋 无法发送文件，转录结果已保存到: {file_path}"
-                    )
-                except:
-                    pass
+                logger.error(f"发送结果消息出错: {str(e)}")
+        
+        # 发送结果文件，按优先级只发送第一个存在的文件
+        for key, caption, saved_hint in FILE_PRIORITY:
+            file_path = result.get(key)
+            if file_path:
+                _send_file(message, file_path, caption, saved_hint)
+                break
         else:
             try:
-                update.message.reply_text(
+                message.reply_text(
                     "⚠️ 未生成结果文件"
                 )
             except Exception as e:
                 logger.error(f"发送无文件消息出错: {str(e)}")
     finally:
         # 恢复代理设置
-        restore_proxies(original_proxies)
+        release_no_proxy()
 
-# 代理管理辅助函数
-def disable_proxies():
-    """禁用所有代理设置并返回原始设置"""
-    original_proxies = {}
-    for proxy_var in ['HTTP_PROXY', 'http_proxy', 'HTTPS_PROXY', 'https_proxy', 'ALL_PROXY', 'all_proxy']:
-        if proxy_var in os.environ:
-            original_proxies[proxy_var] = os.environ[proxy_var]
-            del os.environ[proxy_var]
+def _send_file(message, file_path, caption, saved_hint):
+    """
+    以文档形式发送结果文件，发送失败时至少告知用户文件的保存路径
     
-    # 明确禁用所有代理
-    os.environ['NO_PROXY'] = '*'
-    os.environ['no_proxy'] = '*'
-    
-    return original_proxies
-
-def restore_proxies(original_proxies):
-    """恢复原始代理设置"""
-    # 首先清除NO_PROXY设置
-    if 'NO_PROXY' in os.environ:
-        del os.environ['NO_PROXY']
-    if 'no_proxy' in os.environ:
-        del os.environ['no_proxy']
-    
-    # 然后恢复原始设置
-    for proxy_var, value in original_proxies.items():
-        os.environ[proxy_var] = value
+    参数:
+        message: 要回复的Telegram消息对象
+        file_path: 待发送的文件路径
+        caption: 文件说明
+        saved_hint: 发送失败时提示语中的保存说明，如"结果已保存到"
+    """
+    try:
+        # 超过上传限制的文件必然发送失败，不再读取和上传，直接告知保存路径
+        if os.path.getsize(file_path) > TELEGRAM_UPLOAD_LIMIT:
+            logger.warning(f"文件 {file_path} 超过Telegram上传限制，跳过发送")
+            message.reply_text(
+                f"📋 文件超过Telegram的50MB上传限制，{saved_hint}: {file_path}"
+            )
+            return
+        
+        # InputFile构造时一次性读入文件内容，之后即可关闭文件
+        with open(file_path, 'rb') as file:
+            document = InputFile(file, filename=os.path.basename(file_path))
+        message.reply_document(document=document, caption=caption)
+    except Exception as e:
+        logger.error(f"发送文件 {file_path} 出错: {str(e)}")
+        # 如果文件发送失败，至少发送文件路径
+        try:
+            message.reply_text(
+                f"📋 无法发送文件，{saved_hint}: {file_path}"
+            )
+        except:
+            pass
 
 # 添加错误处理函数定义
 def error_handler(update, context):
@@ -398,6 +348,7 @@ def start_summary_bot():
     """启动字幕摘要机器人"""
     try:
         logger.info("正在启动字幕摘要机器人...")
+        log_allowed_users()
         # 确保目录存在
         os.makedirs(TRANSCRIPTION_RESULTS_DIR, exist_ok=True)
         os.makedirs(TEMP_SUBTITLES_DIR, exist_ok=True)
@@ -406,7 +357,7 @@ def start_summary_bot():
         clean_updates(TELEGRAM_BOT_TOKEN)
         
         # 创建Updater和Dispatcher
-        updater = Updater(TELEGRAM_BOT_TOKEN, use_context=True)
+        updater = Updater(TELEGRAM_BOT_TOKEN, workers=BOT_WORKERS, use_context=True)
         dispatcher = updater.dispatcher
         
         # 设置命令菜单(显示在输入框左侧)
@@ -440,15 +391,8 @@ def start_summary_bot():
         # 添加错误处理器
         dispatcher.add_error_handler(error_handler)
         
-        # 启动机器人 - 使用start_polling而不是idle()来避免阻塞
-        logger.info("启动字幕摘要机器人轮询...")
-        
-        # 首先删除webhook并清除任何待处理的更新
-        updater.bot.delete_webhook()
-        
-        # 启动轮询，设置drop_pending_updates=True避免处理积压的消息
-        updater.start_polling(drop_pending_updates=True)
-        logger.info("字幕摘要机器人轮询已启动")
+        # 启动机器人 - 使用非阻塞的webhook或轮询而不是idle()来避免阻塞
+        start_receiving_updates(updater, TELEGRAM_BOT_TOKEN, "字幕摘要机器人")
         
         return updater  # 返回updater对象以便主程序可以控制
     except Exception as e:
@@ -477,40 +421,25 @@ def start_audio_download_bot():
         logger.error(f"启动音频下载机器人时出错: {str(e)}", exc_info=True)
         return None
 
+@require_auth(MAIN)
 def summary_mode(update: Update, context: CallbackContext) -> int:
     """进入字幕摘要模式"""
-    user_id = str(update.effective_user.id)
-    
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return MAIN
-    
     update.message.reply_text(
         "已进入字幕摘要模式。请发送YouTube链接，我将提取视频字幕并生成摘要。\n\n"
         "您可以随时发送 /start 命令返回主菜单。"
     )
     return SUMMARY
 
+@require_auth(MAIN)
 def handle_summary(update: Update, context: CallbackContext) -> int:
     """处理字幕摘要模式下的用户消息"""
-    user_id = str(update.effective_user.id)
     text = update.message.text
     
-    # 检查用户是否有权限使用机器人
-    if TELEGRAM_ALLOWED_USERS and user_id not in TELEGRAM_ALLOWED_USERS:
-        update.message.reply_text("抱歉，您没有权限使用此机器人。")
-        return MAIN
-    
-    # 检查是否为YouTube链接
-    if is_youtube_url(text):
-        # 启动后台线程处理YouTube视频
-        thread = threading.Thread(
-            target=process_youtube_in_thread,
-            args=(update, context, text)
-        )
-        thread.daemon = True
-        thread.start()
+    # 只匹配一次，同时完成检查和链接提取
+    youtube_url = extract_youtube_link(text)
+    if youtube_url:
+        # 交给Dispatcher的工作线程池处理YouTube视频，未捕获的异常会转交错误处理器
+        context.dispatcher.run_async(process_youtube_in_thread, update, context, youtube_url, update=update)
     else:
         update.message.reply_text(
             "⚠️ 请发送有效的YouTube链接。\n\n"
@@ -529,9 +458,11 @@ def main():
         print("错误: 请在环境变量或配置文件中设置TELEGRAM_BOT_TOKEN")
         return 1
     
+    log_allowed_users()
+    
     try:
         # 创建Updater和Dispatcher
-        updater = Updater(TELEGRAM_BOT_TOKEN, use_context=True)
+        updater = Updater(TELEGRAM_BOT_TOKEN, workers=BOT_WORKERS, use_context=True)
         dispatcher = updater.dispatcher
         
         # 设置命令菜单(显示在输入框左侧)
@@ -565,15 +496,8 @@ def main():
         # 添加错误处理器
         dispatcher.add_error_handler(error_handler)
         
-        # 启动机器人 - 使用start_polling而不是idle()来避免阻塞
-        logger.info("启动字幕摘要机器人轮询...")
-        
-        # 首先删除webhook并清除任何待处理的更新
-        updater.bot.delete_webhook()
-        
-        # 启动轮询，设置drop_pending_updates=True避免处理积压的消息
-        updater.start_polling(drop_pending_updates=True)
-        logger.info("字幕摘要机器人轮询已启动")
+        # 启动机器人 - 使用非阻塞的webhook或轮询而不是idle()来避免阻塞
+        start_receiving_updates(updater, TELEGRAM_BOT_TOKEN, "字幕摘要机器人")
         
         return updater  # 返回updater对象以便主程序可以控制
     
@@ -584,16 +508,8 @@ def main():
 
 if __name__ == "__main__":
     try:
-        # 配置日志
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S',
-            handlers=[
-                logging.StreamHandler(),
-                logging.FileHandler('telegram_bot.log')
-            ]
-        )
+        # 配置日志：控制台和文件输出由后台监听线程完成，处理线程只负责入队
+        setup_logging('telegram_bot.log')
         
         logger.info("======= 启动Telegram机器人服务 =======")
         
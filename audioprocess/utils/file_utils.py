@@ -6,6 +6,7 @@
 """
 
 import os
+import functools
 from pathlib import Path
 from datetime import datetime
 
@@ -28,6 +29,22 @@ def ensure_dir_exists(directory):
         logger.error(f"创建目录时出错: {str(e)}")
         return False
 
+@functools.lru_cache(maxsize=None)
+def ensure_dir_once(directory):
+    """
+    确保目录存在，同一进程内每个路径只创建一次
+    
+    创建失败时抛出异常且不会被缓存，下次调用会重试
+    
+    参数:
+        directory: 目录路径
+        
+    返回:
+        目录路径
+    """
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
 def read_text_file(file_path):
     """
     读取文本文件内容
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+HTTP工具模块
+-----------
+提供进程内共享的HTTP会话，复用连接池避免重复的TCP/TLS握手
+"""
+
+import functools
+import json
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，未安装时回退到标准库
+    orjson = None
+
+@functools.lru_cache(maxsize=1)
+def get_http_session():
+    """
+    获取共享的HTTP会话
+
+    会话挂载了带连接池和重试策略的适配器，同一进程内的多次请求会复用
+    keep-alive连接
+
+    返回:
+        requests.Session对象
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3)
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def loads_json(data):
+    """
+    解析JSON数据，安装了orjson时优先使用orjson
+
+    参数:
+        data: JSON字节串或字符串
+
+    返回:
+        解析后的Python对象
+
+    异常:
+        json.JSONDecodeError: 数据不是合法的JSON（orjson的解析异常是其子类）
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
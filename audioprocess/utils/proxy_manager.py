@@ -7,11 +7,17 @@
 
 import os
 import logging
+import threading
 import contextlib
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 多线程共享的代理禁用状态：引用计数及第一个使用者保存的原始代理设置
+_shared_lock = threading.Lock()
+_shared_refs = 0
+_shared_saved = None
+
 def disable_proxies():
     """
     禁用所有代理设置
@@ -68,6 +74,30 @@ def restore_proxies(original_proxies):
     
     logger.info("已恢复原始代理设置")
 
+def acquire_no_proxy():
+    """
+    以引用计数方式禁用代理，供多个线程同时使用
+    
+    只有第一个使用者真正修改环境变量，之后的调用只增加计数，
+    避免并发任务反复切换os.environ。每次调用都必须对应一次release_no_proxy()
+    """
+    global _shared_refs, _shared_saved
+    with _shared_lock:
+        if _shared_refs == 0:
+            _shared_saved = disable_proxies()
+        _shared_refs += 1
+
+def release_no_proxy():
+    """
+    释放一次acquire_no_proxy()，最后一个使用者离开时恢复原始代理设置
+    """
+    global _shared_refs, _shared_saved
+    with _shared_lock:
+        _shared_refs -= 1
+        if _shared_refs == 0:
+            restore_proxies(_shared_saved)
+            _shared_saved = None
+
 def disable_all_proxies():
     """
     完全禁用所有代理设置，不保留原始设置（用于CLI命令）
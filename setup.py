@@ -23,6 +23,8 @@ setup(
     entry_points={
         'console_scripts': [
             'audioprocess=audioprocess.main:main',
+            'start-audio-bot=audioprocess.scripts.start_audio_bot:main',
+            'start-summary-bot=audioprocess.scripts.start_summary_bot:main',
         ],
     },
     python_requires=">=3.8",
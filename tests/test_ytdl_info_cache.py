@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+测试文件 - 测试缓存的视频信息失效后重新解析
+---------------------------------
+yt-dlp开启ignoreerrors时，使用过期的媒体地址下载不会抛出异常，
+下载器应以未生成文件判断失败，清除缓存并重新解析一次
+"""
+
+import os
+import sys
+import time
+import tempfile
+from unittest import mock
+
+# 添加父目录到 Python 路径，以便导入父目录中的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audioprocess.core import youtube_downloader
+from audioprocess.core.youtube_downloader import YouTubeDownloader
+
+VIDEO_ID = "jNQXAC9IVRw"
+URL = f"https://www.youtube.com/watch?v={VIDEO_ID}"
+
+
+class FakeYDL:
+    """模拟YoutubeDL：缓存的信息下载时错误被吞掉，重新解析后的信息能正常下载"""
+
+    def __init__(self, downloader, output_dir):
+        self.downloader = downloader
+        self.output_dir = output_dir
+        self.extract_calls = 0
+
+    def process_ie_result(self, info, download=True):
+        if not info.get('fresh'):
+            # ignoreerrors=True时yt-dlp只报告错误（如HTTP 403），不抛出异常也不生成文件
+            return info
+        path = os.path.join(self.output_dir, "video.m4a")
+        open(path, 'wb').close()
+        self.downloader._on_progress({'status': 'finished', 'filename': path})
+        return info
+
+    def extract_info(self, url, download=False):
+        self.extract_calls += 1
+        return {'id': VIDEO_ID, 'fresh': True}
+
+    def sanitize_info(self, info, remove_private_keys=False):
+        return info
+
+    def prepare_filename(self, info):
+        return os.path.join(self.output_dir, "missing.m4a")
+
+    def close(self):
+        pass
+
+
+def test_stale_cached_info_is_invalidated_when_download_error_is_swallowed():
+    """缓存信息下载未生成文件时，清除缓存并重新解析后下载成功"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        downloader = YouTubeDownloader(output_path=output_dir)
+        ydl = FakeYDL(downloader, output_dir)
+        downloader._ydl_pool.put((time.time(), ydl))
+
+        cache = youtube_downloader._ytdl_cache
+        stale_info = {'id': VIDEO_ID, 'fresh': False}
+        with mock.patch.object(cache, 'load', return_value=stale_info), \
+                mock.patch.object(cache, 'store') as store, \
+                mock.patch.object(cache, 'invalidate') as invalidate:
+            path = downloader.download(URL)
+
+        assert path == os.path.join(output_dir, "video.m4a")
+        invalidate.assert_called_once_with(VIDEO_ID)
+        assert ydl.extract_calls == 1
+        store.assert_called_once()
+
+
+if __name__ == "__main__":
+    test_stale_cached_info_is_invalidated_when_download_error_is_swallowed()
+    print("测试通过")